@@ -4,11 +4,14 @@ FastAPI tabanlı teknik destek web uygulaması
 """
 
 import os
+import re
+import uuid
+import asyncio
 from pathlib import Path
 from typing import Optional
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse, Response, FileResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, Response, FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
@@ -16,9 +19,13 @@ import requests
 
 import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# src/utils modülleri birbirini düz isimle içe aktarır (search_unified, model_registry, ...)
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'utils'))
 
-from core.tech_support_ai import get_tech_support_ai
+from core.tech_support_ai import get_tech_support_ai, close_async_http_client
 from core.simple_multi_manual import SimpleMultiManual
+from core.session_store import create_session_store, ConversationSession
+from text_normalize import normalize
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -53,6 +60,11 @@ app = FastAPI(
 #         feedback_logger.error("❌ Failed to save final feedback data")
 #     feedback_logger.info("👋 Shutdown complete")
 
+@app.on_event("shutdown")
+async def close_openai_pool():
+    """Paylaşılan OpenAI bağlantı havuzunu kapat"""
+    await close_async_http_client()
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -81,6 +93,7 @@ class FeedbackRequest(BaseModel):
     bot_response: str
     timestamp: str
     reason: Optional[str] = None  # Negative feedback reason
+    product: Optional[str] = None  # Yanıtın verildiği ürün; önbellekten silme için
 
 # Feedback storage
 import json
@@ -109,6 +122,22 @@ try:
 except Exception as e:
     feedback_logger.error(f"❌ Failed to initialize multi-manual system: {e}")
 
+# Kullanıcı başına sohbet durumu (geçmiş + seçili ürün)
+SESSION_COOKIE = "esit_session"
+SESSION_HEADER = "X-Session-ID"
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,128}$")
+session_store = create_session_store()
+
+
+def get_session(http_request: Request, response: Response) -> ConversationSession:
+    """Çerez veya X-Session-ID başlığındaki oturum; yoksa yeni kimlik üretilip çereze yazılır"""
+    session_id = http_request.headers.get(SESSION_HEADER) or http_request.cookies.get(SESSION_COOKIE)
+    if not session_id or not _SESSION_ID_RE.match(session_id):
+        session_id = uuid.uuid4().hex
+    if http_request.cookies.get(SESSION_COOKIE) != session_id:
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="lax", max_age=30 * 24 * 3600)
+    return session_store.get(session_id)
+
 # Legacy PDF path (optional). We no longer require this file; keep info-level log only if present.
 PDF_PATH = str(Path.cwd() / "data" / "processed" / "Esit_ECI_User_Manual_Automatic_ENG_v1_7 kopyası.pdf")
 
@@ -2114,7 +2143,7 @@ async def root():
                         confirmProductSelection(retryCount + 1);
                     }, 1000 * (retryCount + 1)); // Exponential backoff
                 } else {
-                    alert('Ürün seçimi sırasında hata oluştu: ' + error.message + '\n\nLütfen sayfayı yenileyin ve tekrar deneyin.');
+                    alert('Ürün seçimi sırasında hata oluştu: ' + error.message + '\\n\\nLütfen sayfayı yenileyin ve tekrar deneyin.');
                 }
             }
         }
@@ -2138,8 +2167,8 @@ async def root():
                 });
                 const data = await response.json();
                 if (data.success) {
-                    const messageId = 'msg_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9);
-                    addMessage('bot', data.response, messageId, data.image_urls || []);
+                    const messageId = data.message_id || ('msg_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9));
+                    rememberQuestion(addMessage('bot', data.response, messageId, data.image_urls || []), message, data.product);
                     window.lastUserMessage = message;
                 } else {
                     addMessage('bot', 'Üzgünüm, bir hata oluştu. Lütfen tekrar deneyin.');
@@ -2160,8 +2189,15 @@ async def root():
             }
         }
         
+        // Geri bildirim, yanıtın ait olduğu soru ve ürünle gönderilir (önbellekten silme bunlarla yapılır)
+        function rememberQuestion(botDiv, question, product) {
+            botDiv.dataset.userMessage = question;
+            botDiv.dataset.product = product || selectedProduct || '';
+        }
+        
         // Feedback submission function
         async function submitFeedback(messageId, feedbackType, botResponse, reason = null) {
+            const answeredDiv = document.querySelector(`[data-message-id="${messageId}"]`);
             try {
                 const response = await fetch('/feedback', {
                     method: 'POST',
@@ -2171,10 +2207,11 @@ async def root():
                     body: JSON.stringify({
                         message_id: messageId,
                         feedback_type: feedbackType,
-                        user_message: window.lastUserMessage || '',
+                        user_message: (answeredDiv && answeredDiv.dataset.userMessage) || window.lastUserMessage || '',
                         bot_response: botResponse,
                         timestamp: new Date().toISOString(),
-                        reason: reason
+                        reason: reason,
+                        product: (answeredDiv && answeredDiv.dataset.product) || selectedProduct
                     })
                 });
                 
@@ -2310,31 +2347,11 @@ async def root():
             setLoading(true);
             
             try {
-                const response = await fetch('/chat', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify({ 
-                        message: message,
-                        selected_product: selectedProduct
-                    })
-                });
-                
-                if (!response.ok) {
-                    throw new Error(`HTTP ${response.status}`);
-                }
-                const contentType = response.headers.get('content-type');
-                if (!contentType || !contentType.includes('application/json')) {
-                    const text = await response.text();
-                    console.error('Non-JSON /chat response:', text);
-                    throw new Error('Sunucu JSON olmayan bir yanıt döndürdü.');
-                }
-                const data = await response.json();
+                const data = await streamChat(message);
                 
                 if (data.success) {
-                    const messageId = 'msg_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9);
-                    addMessage('bot', data.response, messageId, data.image_urls || []);
+                    const messageId = data.message_id || ('msg_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9));
+                    rememberQuestion(addMessage('bot', data.response, messageId, data.image_urls || []), message, data.product);
                     
                     // Store last user message for feedback
                     window.lastUserMessage = message;
@@ -2361,6 +2378,72 @@ async def root():
             }
         }
         
+        // /chat/stream: yanıt parçalarını geçici bir balonda gösterir, "done" olayının gövdesini döndürür
+        async function streamChat(message) {
+            const response = await fetch('/chat/stream', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({ 
+                    message: message,
+                    selected_product: selectedProduct
+                })
+            });
+            if (!response.ok || !response.body) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            
+            let streamingDiv = null;
+            let streamingContent = null;
+            let streamedText = '';
+            let result = null;
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            try {
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    let boundary;
+                    while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                        const rawEvent = buffer.slice(0, boundary);
+                        buffer = buffer.slice(boundary + 2);
+                        let eventName = 'message';
+                        let dataLine = '';
+                        rawEvent.split('\\n').forEach(line => {
+                            if (line.startsWith('event: ')) eventName = line.slice(7);
+                            else if (line.startsWith('data: ')) dataLine += line.slice(6);
+                        });
+                        if (!dataLine) continue;
+                        const payload = JSON.parse(dataLine);
+                        if (eventName === 'delta') {
+                            if (!streamingDiv) {
+                                // İlk parça geldi: "Düşünüyorum..." yerine yanıt balonu
+                                const loadingMessage = document.getElementById('loading-message');
+                                if (loadingMessage) loadingMessage.remove();
+                                streamingDiv = addMessage('bot', '');
+                                streamingContent = streamingDiv.querySelector('.message-content');
+                            }
+                            streamedText += payload.content;
+                            streamingContent.textContent = streamedText;
+                            messagesContainer.scrollTop = messagesContainer.scrollHeight;
+                        } else if (eventName === 'done') {
+                            result = payload;
+                        }
+                    }
+                }
+            } finally {
+                // Son yanıt geri bildirim butonlarıyla birlikte yeniden çizilir
+                if (streamingDiv) streamingDiv.remove();
+            }
+            if (!result) {
+                throw new Error('Yanıt akışı tamamlanmadan kesildi.');
+            }
+            return result;
+        }
+        
         function addMessage(sender, text, messageId = null, imageUrls = []) {
             const messageDiv = document.createElement('div');
             messageDiv.className = `message ${sender}-message`;
@@ -2440,6 +2523,7 @@ async def root():
                     behavior: 'smooth'
                 });
             }, 50);
+            return messageDiv;
         }
         
         function setLoading(loading) {
@@ -2501,17 +2585,35 @@ async def root():
     """
     return HTMLResponse(content=html_content)
 
+def _with_chat_context(result: dict) -> dict:
+    """/chat ve /chat/stream yanıtlarına çoklu kılavuz bilgisini ekle"""
+    # Add multi-manual context to response
+    if multi_manual_system:
+        result["available_products"] = [p["product_name"] for p in multi_manual_system.get_all_products()]
+        result["product_categories"] = multi_manual_system.get_categories()
+        result["total_products"] = len(multi_manual_system.get_all_products())
+    
+    # Ensure image_urls always present for frontend simplicity
+    if "image_urls" not in result:
+        result["image_urls"] = []
+    
+    return result
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
 @app.post("/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request, response: Response):
     """Ana sohbet endpoint'i - çoklu PDF desteği ile"""
     try:
         # Get AI instance (now supports multi-manual automatically)
         ai = get_tech_support_ai(PDF_PATH)
         if not ai:
             raise HTTPException(status_code=500, detail="AI system not initialized")
+        session = get_session(http_request, response)
         
-        # Require product selection; block if not set both on request and server state
-        if not (request.selected_product or ai.current_product):
+        # Require product selection; block if not set both on request and session state
+        if not (request.selected_product or session.product):
             return {
                 "success": False,
                 "response": "Lütfen önce bir ürün seçin.",
@@ -2520,22 +2622,14 @@ async def chat(request: ChatRequest):
 
         # Eğer kullanıcı ürün seçtiyse, AI'ya bildir
         if request.selected_product:
-            ai.current_product = request.selected_product
+            session.product = request.selected_product
         
         # Generate response (AI now has multi-manual context built-in)
-        result = ai.generate_response(request.message)
+        # Asenkron yol: arama iş parçacığında, LLM çağrısı event loop'u bloklamadan
+        result = await ai.agenerate_response(request.message, session=session)
+        session_store.save(session)
         
-        # Add multi-manual context to response
-        if multi_manual_system:
-            result["available_products"] = [p["product_name"] for p in multi_manual_system.get_all_products()]
-            result["product_categories"] = multi_manual_system.get_categories()
-            result["total_products"] = len(multi_manual_system.get_all_products())
-        
-        # Ensure image_urls always present for frontend simplicity
-        if "image_urls" not in result:
-            result["image_urls"] = []
-        
-        return result
+        return _with_chat_context(result)
         
     except Exception as e:
         print(f"Chat error: {e}")
@@ -2545,8 +2639,47 @@ async def chat(request: ChatRequest):
             "success": False
         }
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    """/chat'in Server-Sent Events sürümü: yanıt parçaları geldikçe gönderilir
+    
+    Olaylar: `delta` ({"content": "..."}) ve son olarak `/chat` yanıtıyla aynı gövdeli `done`.
+    """
+    ai = get_tech_support_ai(PDF_PATH)
+    if not ai:
+        raise HTTPException(status_code=500, detail="AI system not initialized")
+    cookie_carrier = Response()
+    session = get_session(http_request, cookie_carrier)
+    if request.selected_product:
+        session.product = request.selected_product
+    
+    async def events():
+        if not session.product:
+            yield _sse("done", {"success": False, "response": "Lütfen önce bir ürün seçin.", "needs_product": True})
+            return
+        try:
+            async for event in ai.astream_response(request.message, session=session):
+                if event["type"] == "delta":
+                    yield _sse("delta", {"content": event["content"]})
+                else:
+                    session_store.save(session)
+                    yield _sse("done", _with_chat_context(event["result"]))
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            yield _sse("done", {
+                "response": "Üzgünüm, şu anda teknik bir sorun yaşıyorum. Lütfen tekrar deneyin.",
+                "error": str(e),
+                "success": False
+            })
+    
+    # Proxy tamponlamasını kapat ki ilk parça hemen ulaşsın
+    response = StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.raw_headers.extend(h for h in cookie_carrier.raw_headers if h[0] == b"set-cookie")
+    return response
+
 @app.post("/select-product")
-async def select_product(request: ProductSelectionRequest):
+async def select_product(request: ProductSelectionRequest, http_request: Request, response: Response):
     """Kullanıcının seçtiği ürünü AI'ya bildir"""
     try:
         ai = get_tech_support_ai(PDF_PATH)
@@ -2566,8 +2699,10 @@ async def select_product(request: ProductSelectionRequest):
                 "available_products": available_products
             }
         
-        # AI'ya ürünü bildir
-        ai.current_product = request.product_name
+        # Ürünü kullanıcının oturumuna yaz
+        session = get_session(http_request, response)
+        session.product = request.product_name
+        session_store.save(session)
         
         return {
             "success": True,
@@ -2582,12 +2717,10 @@ async def select_product(request: ProductSelectionRequest):
         raise HTTPException(status_code=500, detail=f"Sunucu hatası: {str(e)}")
 
 @app.post("/reset")
-async def reset_conversation():
+async def reset_conversation(http_request: Request, response: Response):
     """Konuşmayı sıfırla"""
     try:
-        ai = get_tech_support_ai(PDF_PATH)
-        if ai:
-            ai.reset_conversation()
+        session_store.delete(get_session(http_request, response).session_id)
         return {"success": True, "message": "Konuşma sıfırlandı"}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -2662,6 +2795,13 @@ async def submit_feedback(request: FeedbackRequest):
         if request.reason:
             feedback_logger.info(f"   Reason: {request.reason}")
         
+        # Olumsuz değerlendirilen yanıt önbellekten çıkarılır, aynı soru yeniden yanıtlanır.
+        # Soru vektörü gerekirse MiniLM çalışır: event loop'u (açık SSE akışlarını) bloklamamak için thread'de
+        if request.feedback_type == "negative":
+            ai = get_tech_support_ai(PDF_PATH)
+            if ai and await asyncio.to_thread(ai.forget_answer, request.message_id, request.product, request.user_message):
+                feedback_logger.info(f"🗑️ Cached answer evicted for message {request.message_id}")
+        
         # Stats
         
         if supabase_enabled():
@@ -2866,11 +3006,11 @@ async def search_manuals(query: str, category: str = None):
         
         # Simple text search in product names
         matching_products = []
-        query_lower = query.lower()
+        query_lower = normalize(query)
         
         for product in products:
-            if (query_lower in product["product_name"].lower() or 
-                query_lower in product["product_category"].lower()):
+            if (query_lower in normalize(product["product_name"]) or 
+                query_lower in normalize(product["product_category"])):
                 matching_products.append(product)
         
         return {
@@ -2889,6 +3029,7 @@ async def search_manuals(query: str, category: str = None):
 @app.get("/health")
 async def health():
     """Health check"""
+    ai = get_tech_support_ai()
     return {
         "status": "ok",
         "system": "ESİT Technical Support AI",
@@ -2896,7 +3037,9 @@ async def health():
         "multi_manual_enabled": multi_manual_system is not None,
         "available_products": len(multi_manual_system.get_all_products()) if multi_manual_system else 0,
         "product_categories": multi_manual_system.get_categories() if multi_manual_system else [],
-        "supabase_enabled": supabase_enabled()
+        "supabase_enabled": supabase_enabled(),
+        "sessions": session_store.stats(),
+        "answer_cache": ai.answer_cache.stats() if ai and ai.answer_cache is not None else None
     }
 
 @app.get("/test-supabase")
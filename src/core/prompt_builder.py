@@ -0,0 +1,146 @@
+"""
+Token-budgeted prompt assembly for the chat completion.
+
+The system prompt, the retrieved manual chunks (best score first) and the conversation history
+are packed into PROMPT_TOKEN_BUDGET input tokens. Tokens are counted with tiktoken; if its encoding
+cannot be loaded (e.g. no network for the first download) a conservative characters-per-token
+estimate is used.
+Text that does not fit is cut at a sentence or word boundary, never mid-word.
+"""
+
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+HISTORY_SHARE = 0.35  # bütçenin geçmişe ayrılan azami payı; kalan kılavuz bağlamına gider
+MAX_HISTORY_MESSAGE_TOKENS = 400
+MIN_CHUNK_TOKENS = 64  # daha kısa kesilmiş parça anlamsızdır
+MESSAGE_OVERHEAD_TOKENS = 4  # her chat mesajının rol/ayraç maliyeti
+CHARS_PER_TOKEN = 3  # tiktoken kodlaması yüklenemezse tahmin; Türkçe metinde gerçek oran daha yüksektir
+TOKENIZER_MODEL = "gpt-4o-mini"
+
+_encoding: Any = None
+_encoding_loaded = False
+
+
+def _get_encoding() -> Any:
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            try:
+                _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+            except KeyError:
+                _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            print(f"⚠️ tiktoken unavailable ({e}); estimating prompt tokens from length")
+            _encoding = None
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _cut_at_boundary(text: str) -> str:
+    """Drop the trailing partial sentence (or word) of a cut text."""
+    for sep in (". ", ".\n", "\n", "! ", "? "):
+        pos = text.rfind(sep)
+        if pos >= len(text) * 0.6:
+            return text[:pos + 1].rstrip()
+    pos = text.rfind(" ")
+    return text[:pos] if pos > 0 else text
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """text if it fits in max_tokens, else its longest prefix that does, ending on a boundary."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    # " …" için bir token payı bırakılır
+    encoding = _get_encoding()
+    if encoding is None:
+        prefix = text[:(max_tokens - 1) * CHARS_PER_TOKEN]
+    else:
+        prefix = encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens - 1])
+    return _cut_at_boundary(prefix) + " …"
+
+
+def _message_tokens(content: str) -> int:
+    return count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def pack_context(chunks: Sequence[Dict[str, Any]], budget: int) -> Tuple[str, int]:
+    """Join the best-scoring chunks that fit in budget tokens; returns (context, tokens used).
+
+    Chunks are {"text", "score"}; chunks without a score keep their order after the scored ones.
+    """
+    chunks = [c for c in chunks if c.get("text", "").strip()]
+    ranked = sorted((c for c in chunks if c.get("score") is not None), key=lambda c: c["score"], reverse=True)
+    ranked += [c for c in chunks if c.get("score") is None]
+
+    selected: List[str] = []
+    used = 0
+    for chunk in ranked:
+        text = chunk["text"]
+        cost = count_tokens(text) + 1  # "\n\n" ayracı
+        if used + cost > budget:
+            # Sığmayan en iyi parça, yer varsa cümle sınırında kısaltılarak alınır
+            if selected or budget - used < MIN_CHUNK_TOKENS:
+                continue
+            text = truncate_to_tokens(text, budget - used - 1)
+            cost = count_tokens(text) + 1
+        selected.append(text)
+        used += cost
+    return "\n\n".join(selected), used
+
+
+def build_prompt_messages(render_system: Callable[[str], str], chunks: Sequence[Dict[str, Any]],
+                          history: Sequence[Dict[str, str]], user_input: str, summary: str = "",
+                          budget: int = PROMPT_TOKEN_BUDGET) -> List[Dict[str, str]]:
+    """
+    Chat messages for one turn within budget input tokens
+
+    Args:
+        render_system: Builds the system prompt around a manual context string
+        chunks: Retrieved manual chunks ({"text", "score"})
+        history: Earlier messages of the conversation, oldest first (without user_input)
+        user_input: The current question
+        summary: Compacted summary of older turns
+    """
+    user_input = truncate_to_tokens(user_input, budget // 4)
+    remaining = budget - _message_tokens(render_system("")) - _message_tokens(user_input)
+
+    # En yeni mesajdan geriye: tek bir uzun mesaj tüm geçmiş payını yiyemez
+    recent: List[Tuple[Dict[str, str], int]] = []
+    for m in reversed(history):
+        content = truncate_to_tokens(m.get("content", ""), MAX_HISTORY_MESSAGE_TOKENS)
+        if content:
+            recent.append(({"role": m.get("role", "user"), "content": content}, _message_tokens(content)))
+    summary_message: Optional[Dict[str, str]] = None
+    if summary:
+        summary_message = {"role": "system", "content": f"Önceki konuşmanın özeti:\n{summary}"}
+    history_need = sum(cost for _, cost in recent) + (_message_tokens(summary_message["content"]) if summary_message else 0)
+    history_reserve = min(history_need, int(max(remaining, 0) * HISTORY_SHARE))
+
+    context, used = pack_context(chunks, remaining - history_reserve)
+    remaining -= used
+
+    history_messages: List[Dict[str, str]] = []
+    for message, cost in recent:
+        if cost > remaining:
+            break
+        history_messages.append(message)
+        remaining -= cost
+    history_messages.reverse()
+    if summary_message and _message_tokens(summary_message["content"]) <= remaining:
+        history_messages.insert(0, summary_message)
+
+    return [{"role": "system", "content": render_system(context)}] + history_messages + [
+        {"role": "user", "content": user_input}
+    ]
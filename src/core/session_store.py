@@ -0,0 +1,209 @@
+"""
+Per-user conversation state (history + selected product), keyed by a session id.
+
+By default sessions live in an in-process LRU with idle eviction. With SESSION_BACKEND=sqlite
+(a shared file) or SESSION_BACKEND=redis (any Redis-compatible server) every request reads the
+session from the backend, so any worker or replica can serve it. History is compacted as it
+grows: old turns are folded into a short summary, which keeps each session's size bounded.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "7200"))
+SESSION_MAX_HISTORY = int(os.getenv("SESSION_MAX_HISTORY", "16"))  # mesaj sayısı; prompt bunlardan token bütçesine sığanları kullanır
+MAX_MESSAGE_CHARS = 4000
+SUMMARY_LINE_CHARS = 160
+SUMMARY_MAX_CHARS = 1500
+DEFAULT_SESSION_DB = str(Path(__file__).resolve().parents[2] / "data" / "processed" / "sessions.sqlite")
+
+
+class ConversationSession:
+    def __init__(self, session_id: str, history: Optional[List[Dict[str, str]]] = None,
+                 product: Optional[str] = None, summary: str = "", last_seen: Optional[float] = None):
+        self.session_id = session_id
+        self.history: List[Dict[str, str]] = history or []
+        self.product = product
+        self.summary = summary
+        self.last_seen = last_seen or time.time()
+
+    def add_message(self, role: str, content: str, message_id: Optional[str] = None) -> None:
+        if len(content) > MAX_MESSAGE_CHARS:
+            content = content[:MAX_MESSAGE_CHARS] + " …"
+        message = {"role": role, "content": content}
+        if message_id:
+            message["message_id"] = message_id
+        self.history.append(message)
+        self.compact()
+
+    def compact(self, max_messages: int = SESSION_MAX_HISTORY) -> None:
+        """Fold the oldest turns into the summary once history exceeds max_messages."""
+        overflow = len(self.history) - max_messages
+        if overflow <= 0:
+            return
+        dropped, self.history = self.history[:overflow], self.history[overflow:]
+        # Kullanıcı soruları özetin iskeletidir; uzun asistan yanıtları yalnızca kısaltılarak tutulur
+        lines = [self.summary] if self.summary else []
+        for m in dropped:
+            prefix = "Kullanıcı" if m.get("role") == "user" else "Asistan"
+            text = " ".join(m.get("content", "").split())
+            lines.append(f"- {prefix}: {text[:SUMMARY_LINE_CHARS]}")
+        summary = "\n".join(lines)
+        if len(summary) > SUMMARY_MAX_CHARS:
+            summary = summary[-SUMMARY_MAX_CHARS:].split("\n", 1)[-1]
+        self.summary = summary
+
+    def reset(self) -> None:
+        self.history = []
+        self.product = None
+        self.summary = ""
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"history": self.history, "product": self.product, "summary": self.summary, "last_seen": self.last_seen}
+
+    @classmethod
+    def from_dict(cls, session_id: str, data: Dict[str, Any]) -> "ConversationSession":
+        return cls(session_id, data.get("history"), data.get("product"), data.get("summary", ""), data.get("last_seen"))
+
+
+class SQLiteSessionBackend:
+    """Sessions as JSON rows in a SQLite file shared by all workers on a host."""
+
+    PURGE_EVERY = 256  # kayıt; boşta kalan oturumlar bu aralıkla silinir
+
+    def __init__(self, path: str, idle_ttl: float):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._saves = 0
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)")
+        self._conn.commit()
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT data, updated_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None or (self.idle_ttl > 0 and time.time() - row[1] > self.idle_ttl):
+            return None
+        return json.loads(row[0])
+
+    def save(self, session_id: str, data: Dict[str, Any]) -> None:
+        payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO sessions (id, data, updated_at) VALUES (?, ?, ?)",
+                               (session_id, payload, time.time()))
+            self._saves += 1
+            if self.idle_ttl > 0 and self._saves % self.PURGE_EVERY == 0:
+                self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.idle_ttl,))
+            self._conn.commit()
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._conn.commit()
+
+
+class RedisSessionBackend:
+    """Sessions in a Redis-compatible server; idle eviction is the key TTL, refreshed on every save."""
+
+    KEY_PREFIX = "esit:session:"
+
+    def __init__(self, url: str, idle_ttl: float):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("SESSION_BACKEND=redis requires the 'redis' package (pip install redis)") from e
+        self.idle_ttl = idle_ttl
+        self._client = redis.Redis.from_url(url)
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        payload = self._client.get(self.KEY_PREFIX + session_id)
+        return json.loads(payload) if payload else None
+
+    def save(self, session_id: str, data: Dict[str, Any]) -> None:
+        payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        ttl = int(self.idle_ttl) if self.idle_ttl > 0 else None
+        self._client.set(self.KEY_PREFIX + session_id, payload, ex=ttl)
+
+    def delete(self, session_id: str) -> None:
+        self._client.delete(self.KEY_PREFIX + session_id)
+
+
+class SessionStore:
+    def __init__(self, maxsize: int = SESSION_MAX, idle_ttl: float = SESSION_IDLE_TTL, backend: Any = None):
+        """maxsize bounds the in-process LRU; idle_ttl (seconds, <= 0: never) evicts untouched sessions."""
+        self.maxsize = maxsize
+        self.idle_ttl = idle_ttl
+        self.backend = backend
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict_idle(self, now: float) -> None:
+        # LRU sırası = son erişim sırası, bu yüzden boşta kalanlar hep baştadır
+        while self._sessions and self.idle_ttl > 0:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_seen <= self.idle_ttl:
+                break
+            self._sessions.popitem(last=False)
+
+    def get(self, session_id: str) -> ConversationSession:
+        """The session for session_id, or a new empty one."""
+        now = time.time()
+        if self.backend is not None:
+            data = self.backend.load(session_id)
+            session = ConversationSession.from_dict(session_id, data) if data else ConversationSession(session_id)
+            session.last_seen = now
+            return session
+        with self._lock:
+            self._evict_idle(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = ConversationSession(session_id)
+                self._sessions[session_id] = session
+                while len(self._sessions) > self.maxsize:
+                    self._sessions.popitem(last=False)
+            self._sessions.move_to_end(session_id)
+            session.last_seen = now
+            return session
+
+    def save(self, session: ConversationSession) -> None:
+        session.last_seen = time.time()
+        if self.backend is not None:
+            self.backend.save(session.session_id, session.to_dict())
+
+    def delete(self, session_id: str) -> None:
+        if self.backend is not None:
+            self.backend.delete(session_id)
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else "memory",
+            "local_sessions": len(self._sessions),
+            "maxsize": self.maxsize,
+            "idle_ttl": self.idle_ttl,
+        }
+
+
+def create_session_store() -> SessionStore:
+    """Session store configured from SESSION_BACKEND (memory | sqlite | redis)."""
+    backend_name = os.getenv("SESSION_BACKEND", "memory").lower()
+    backend = None
+    if backend_name == "sqlite":
+        backend = SQLiteSessionBackend(os.getenv("SESSION_DB_PATH", DEFAULT_SESSION_DB), SESSION_IDLE_TTL)
+    elif backend_name == "redis":
+        backend = RedisSessionBackend(os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0"), SESSION_IDLE_TTL)
+    elif backend_name != "memory":
+        print(f"⚠️ Unknown SESSION_BACKEND '{backend_name}', using in-process sessions")
+    return SessionStore(backend=backend)
@@ -5,16 +5,56 @@ PDF tabanlı akıllı teknik destek sistemi
 
 import os
 import json
-from typing import Dict, List, Any, Optional
+import uuid
+import asyncio
+from typing import AsyncIterator, Dict, List, Any, Optional, Tuple, Union
 from pathlib import Path
 
-from openai import OpenAI
+import httpx
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
 from .simple_multi_manual import SimpleMultiManual
+from text_normalize import normalize
+from answer_cache import SemanticAnswerCache
+from .session_store import ConversationSession
+from .prompt_builder import build_prompt_messages
 
 # Load environment
 load_dotenv()
 
+# Sohbet tamamlama parametreleri (senkron ve asenkron yol ortak kullanır)
+CHAT_COMPLETION_PARAMS = {
+    "model": "gpt-4o-mini",  # Fine-tuned model ID'niz varsa burayı değiştirin
+    "temperature": 0.1,  # Fine-tuned model için daha düşük
+    "max_tokens": 800,   # Daha odaklı yanıtlar
+    "top_p": 0.9,        # Daha deterministik
+    "frequency_penalty": 0.1  # Tekrar azaltma
+}
+
+# Tüm asenkron OpenAI çağrıları tek bir bağlantı havuzunu paylaşır
+_async_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Process-wide pooled HTTP client for AsyncOpenAI (keep-alive connections are reused across chats)."""
+    global _async_http_client
+    if _async_http_client is None or _async_http_client.is_closed:
+        _async_http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "200")),
+                max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", "50"))
+            ),
+            timeout=httpx.Timeout(float(os.getenv("OPENAI_TIMEOUT", "60")), connect=10.0)
+        )
+    return _async_http_client
+
+
+async def close_async_http_client() -> None:
+    global _async_http_client
+    if _async_http_client is not None and not _async_http_client.is_closed:
+        await _async_http_client.aclose()
+    _async_http_client = None
+
 class TechnicalSupportAI:
     """ESİT Teknik Destek AI Aracı"""
     
@@ -27,17 +67,20 @@ class TechnicalSupportAI:
         """
         self.pdf_path = pdf_path
         self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self._async_client: Optional[AsyncOpenAI] = None
+        self._async_http_client: Optional[httpx.AsyncClient] = None
         
         # Initialize multi-manual system
         self.multi_manual = SimpleMultiManual()
         
         # Initialize PDF search system (legacy)
         self._init_pdf_search()
+        # Sık sorulan sorular için anlamsal yanıt önbelleği
+        self.answer_cache = self._init_answer_cache()
         
-        # Conversation history for context
-        self.conversation_history = []
-        # Kullanıcının üzerinde çalıştığı ürün (sohbet boyunca tutulur)
-        self.current_product: Optional[str] = None
+        # Sohbet durumu oturum başına tutulur (core.session_store); session verilmeyen
+        # çağrılar (CLI, testler) bu varsayılan oturumu kullanır
+        self._default_session = ConversationSession("default")
         
         # Technical categories for better problem classification
         self.tech_categories = {
@@ -49,6 +92,33 @@ class TechnicalSupportAI:
             "installation": ["kurulum", "installation", "setup", "montaj"],
             "maintenance": ["bakım", "maintenance", "temizlik", "cleaning", "servis"]
         }
+        # Anahtar kelimeler bir kez normalize edilir; eşleşme İ/ı ve aksan farklarından etkilenmez
+        self._category_keywords = {
+            category: [normalize(k) for k in keywords] for category, keywords in self.tech_categories.items()
+        }
+        self._howto_words = [normalize(w) for w in ["nasıl", "how", "ne zaman", "when", "nerede", "where"]]
+        self._problem_words = [normalize(w) for w in ["sorun", "problem", "hata", "error"]]
+    
+    @property
+    def conversation_history(self) -> List[Dict[str, str]]:
+        return self._default_session.history
+    
+    @property
+    def current_product(self) -> Optional[str]:
+        return self._default_session.product
+    
+    @current_product.setter
+    def current_product(self, product: Optional[str]) -> None:
+        self._default_session.product = product
+    
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """AsyncOpenAI on the shared connection pool; created on first use inside the event loop."""
+        http_client = get_async_http_client()
+        if self._async_client is None or self._async_http_client is not http_client:
+            self._async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
+            self._async_http_client = http_client
+        return self._async_client
     
     def _init_pdf_search(self):
         """Initialize PDF search system"""
@@ -63,6 +133,27 @@ class TechnicalSupportAI:
             print(f"❌ PDF search initialization failed: {e}")
             self.searcher = None
     
+    def _init_answer_cache(self) -> Optional[SemanticAnswerCache]:
+        """Answer cache keyed on the question's MiniLM vector; shares the model and vectors with search"""
+        try:
+            from model_registry import get_model, TEXT_MODEL
+            from search_unified import encode_normalized_query
+        except ImportError as e:
+            print(f"⚠️ Answer cache disabled: Missing dependencies ({e})")
+            return None
+        return SemanticAnswerCache(lambda question: encode_normalized_query(get_model(TEXT_MODEL), TEXT_MODEL, question))
+    
+    def forget_answer(self, message_id: str, product: Optional[str] = None, question: Optional[str] = None) -> bool:
+        """Olumsuz geri bildirim alan yanıtı önbellekten çıkar"""
+        if self.answer_cache is None:
+            return False
+        if self.answer_cache.evict_message(message_id):
+            return True
+        # Mesaj başka bir worker'da yanıtlanmış olabilir: ürün + soru ile eşleştirilir
+        if product and question:
+            return self.answer_cache.evict_question(product, question) > 0
+        return False
+    
     def classify_problem(self, user_input: str) -> Dict[str, Any]:
         """
         Classify user problem into technical categories
@@ -73,11 +164,11 @@ class TechnicalSupportAI:
         Returns:
             Dictionary with classification results
         """
-        user_lower = user_input.lower()
+        user_lower = normalize(user_input)
         
         # Find matching categories
         matched_categories = []
-        for category, keywords in self.tech_categories.items():
+        for category, keywords in self._category_keywords.items():
             if any(keyword in user_lower for keyword in keywords):
                 matched_categories.append(category)
         
@@ -87,13 +178,13 @@ class TechnicalSupportAI:
             problem_type = matched_categories[0]  # Take first match
         
         # Check if it's a how-to question
-        is_howto = any(word in user_lower for word in ["nasıl", "how", "ne zaman", "when", "nerede", "where"])
+        is_howto = any(word in user_lower for word in self._howto_words)
         
         return {
             "categories": matched_categories,
             "primary_category": problem_type,
             "is_howto": is_howto,
-            "has_problem": len(matched_categories) > 0 or any(word in user_lower for word in ["sorun", "problem", "hata", "error"])
+            "has_problem": len(matched_categories) > 0 or any(word in user_lower for word in self._problem_words)
         }
     
     def search_manual(self, query: str, max_results: int = 5) -> Dict[str, Any]:
@@ -111,10 +202,15 @@ class TechnicalSupportAI:
             return {"error": "PDF search not available"}
         
         try:
-            results = self.searcher.search(query, top_k=max_results)
+            from search_unified import query_wants_images
+            # Görsel içermeyen sorularda CLIP kodlaması ve görsel indeksi atlanır
+            modalities = None if query_wants_images(query) else ["text", "tables"]
+            results = self.searcher.search(query, top_k=max_results, modalities=modalities)
             
             # Extract relevant information
+            # context_chunks: skorlu parçalar; prompt bütçesine en iyi skordan başlanarak yerleştirilir
             context_parts = []
+            context_chunks = []
             
             # Process text results
             if "by_modality" in results and "text" in results["by_modality"]:
@@ -123,6 +219,7 @@ class TechnicalSupportAI:
                     text = item.get("text", "")
                     if text.strip():
                         context_parts.append(f"[Sayfa {page}] {text}")
+                        context_chunks.append({"text": context_parts[-1], "score": item.get("score")})
             
             # Process table results
             if "by_modality" in results and "tables" in results["by_modality"]:
@@ -131,6 +228,7 @@ class TechnicalSupportAI:
                     markdown = item.get("markdown", "")
                     if markdown.strip():
                         context_parts.append(f"[Tablo - Sayfa {page}] {markdown}")
+                        context_chunks.append({"text": context_parts[-1], "score": item.get("score")})
             
             # Process image results
             image_references = []
@@ -145,6 +243,7 @@ class TechnicalSupportAI:
             # Add image references to context
             if image_references:
                 context_parts.append(f"İlgili görseller: {', '.join(image_references)}")
+                context_chunks.append({"text": context_parts[-1], "score": None})
             
             # Build image URLs for frontend if paths exist
             image_urls = []
@@ -162,6 +261,7 @@ class TechnicalSupportAI:
 
             return {
                 "context": "\n\n".join(context_parts),
+                "context_chunks": context_chunks,
                 "total_results": len(context_parts),
                 "raw_results": results,
                 "image_references": image_references,
@@ -183,6 +283,7 @@ class TechnicalSupportAI:
             Processed search results in single manual format
         """
         context_parts = []
+        context_chunks = []
         image_urls = []
         image_references = []
         
@@ -195,6 +296,7 @@ class TechnicalSupportAI:
                     text = item.get("text", "")
                     if text.strip():
                         context_parts.append(f"[{product_name} - Sayfa {page}] {text}")
+                        context_chunks.append({"text": context_parts[-1], "score": item.get("score")})
             
             # Process table results
             if "by_modality" in multi_results and "tables" in multi_results["by_modality"]:
@@ -204,6 +306,7 @@ class TechnicalSupportAI:
                     markdown = item.get("markdown", "")
                     if markdown.strip():
                         context_parts.append(f"[{product_name} - Tablo Sayfa {page}] {markdown}")
+                        context_chunks.append({"text": context_parts[-1], "score": item.get("score")})
             
             # Process image results
             if "by_modality" in multi_results and "images" in multi_results["by_modality"]:
@@ -232,13 +335,16 @@ class TechnicalSupportAI:
                 
                 if relevant_products:
                     context_parts.append(f"İlgili Ürünler: {', '.join(relevant_products)}")
+                    context_chunks.append({"text": context_parts[-1], "score": None})
             
             # Add image references to context
             if image_references:
                 context_parts.append(f"İlgili görseller: {', '.join(image_references)}")
+                context_chunks.append({"text": context_parts[-1], "score": None})
             
             return {
                 "context": "\n\n".join(context_parts),
+                "context_chunks": context_chunks,
                 "total_results": len(context_parts),
                 "image_references": image_references,
                 "image_urls": image_urls,
@@ -249,30 +355,110 @@ class TechnicalSupportAI:
             print(f"Multi-manual processing error: {e}")
             return {"error": str(e), "context": "", "total_results": 0}
     
-    def generate_response(self, user_input: str, search_results: Dict[str, Any] = None) -> Dict[str, Any]:
+    def generate_response(self, user_input: str, search_results: Dict[str, Any] = None,
+                          session: Optional[ConversationSession] = None) -> Dict[str, Any]:
         """
         Generate AI response for technical support
         
         Args:
             user_input: User's question or problem
+            session: Conversation state of the user (default session when omitted)
             
         Returns:
             AI response with technical information
         """
+        session = session or self._default_session
+        prepared = self._prepare_response(user_input, search_results, session)
+        if isinstance(prepared, dict):
+            return prepared
+        messages, classification, search_results, has_manual_info, answer_key = prepared
+        
+        try:
+            response = self.client.chat.completions.create(messages=messages, **CHAT_COMPLETION_PARAMS)
+            return self._finish_response(response.choices[0].message.content, classification, search_results, has_manual_info, session, answer_key)
+        except Exception as e:
+            return self._error_response(e)
+    
+    async def agenerate_response(self, user_input: str, search_results: Dict[str, Any] = None,
+                                 session: Optional[ConversationSession] = None) -> Dict[str, Any]:
+        """
+        generate_response'un event loop'u bloklamayan sürümü
+        
+        Kılavuz araması (CPU) bir iş parçacığında, LLM çağrısı AsyncOpenAI ile yapılır; böylece
+        tek bir worker aynı anda çok sayıda sohbeti bekletmeden yürütebilir.
+        """
+        session = session or self._default_session
+        prepared = await asyncio.to_thread(self._prepare_response, user_input, search_results, session)
+        if isinstance(prepared, dict):
+            return prepared
+        messages, classification, search_results, has_manual_info, answer_key = prepared
+        
+        try:
+            response = await self.async_client.chat.completions.create(messages=messages, **CHAT_COMPLETION_PARAMS)
+            return self._finish_response(response.choices[0].message.content, classification, search_results, has_manual_info, session, answer_key)
+        except Exception as e:
+            return self._error_response(e)
+    
+    async def astream_response(self, user_input: str, search_results: Dict[str, Any] = None,
+                               session: Optional[ConversationSession] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        agenerate_response'un akış (stream) sürümü
+        
+        Yanıt parçalarını {"type": "delta", "content": ...} olarak, sonunda da generate_response ile
+        aynı sonuç sözlüğünü {"type": "done", "result": ...} olarak üretir. Geçmişe yalnızca tamamlanan
+        yanıt yazılır.
+        """
+        session = session or self._default_session
+        prepared = await asyncio.to_thread(self._prepare_response, user_input, search_results, session)
+        if isinstance(prepared, dict):
+            yield {"type": "done", "result": prepared}
+            return
+        messages, classification, search_results, has_manual_info, answer_key = prepared
+        
+        parts: List[str] = []
+        try:
+            stream = await self.async_client.chat.completions.create(messages=messages, stream=True, **CHAT_COMPLETION_PARAMS)
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield {"type": "delta", "content": delta}
+        except Exception as e:
+            yield {"type": "done", "result": self._error_response(e)}
+            return
+        yield {"type": "done", "result": self._finish_response("".join(parts), classification, search_results, has_manual_info, session, answer_key)}
+    
+    def _prepare_response(self, user_input: str, search_results: Optional[Dict[str, Any]],
+                          session: ConversationSession) -> Union[Dict[str, Any], Tuple[List[Dict[str, str]], Dict[str, Any], Dict[str, Any], bool, Optional[tuple]]]:
+        """Ürün tespiti, sınıflandırma, arama ve mesajlar; erken dönüş gerekiyorsa yanıt sözlüğü döner"""
         # Add to conversation history
-        self.conversation_history.append({"role": "user", "content": user_input})
+        session.add_message("user", user_input)
         
         # Ürün tespiti (mesaj + geçmiş üzerinden)
         # Not: Bir ürün zaten seçildiyse (UI'dan), mid-conversation ürün değişikliği yapmayız
-        if not self.current_product:
+        if not session.product:
             detected_product = self._detect_product_from_text(user_input)
             if detected_product:
-                self.current_product = detected_product
+                session.product = detected_product
 
         # Eğer ürün belirlenmediyse, ilk etapta kullanıcıdan cihazı netleştirmesini iste
-        if not self.current_product:
+        if not session.product:
             return self._ask_for_product_clarification()
 
+        # Yanıt önbelleği: yalnızca sohbetin ilk sorusu (geçmişe bağlı olmayan) önbellekten yanıtlanır ve yazılır
+        answer_key = None
+        if self.answer_cache is not None and search_results is None and len(session.history) == 1 and not session.summary:
+            try:
+                question_vec = self.answer_cache.question_vector(user_input)
+                cached = self.answer_cache.lookup(session.product, question_vec)
+            except Exception as e:
+                print(f"⚠️ Answer cache lookup failed: {e}")
+                question_vec, cached = None, None
+            if cached is not None:
+                return self._cached_response(cached, session)
+            if question_vec is not None:
+                answer_key = (session.product, question_vec, user_input)
+
         # Classify the problem
         classification = self.classify_problem(user_input)
         
@@ -294,55 +480,67 @@ class TechnicalSupportAI:
         has_manual_info = search_results.get("total_results", 0) > 0
         
         # Create AI prompt
-        system_prompt = self._build_system_prompt(classification, context, has_manual_info)
+        # Sistem promptu, kılavuz parçaları (skora göre) ve geçmiş PROMPT_TOKEN_BUDGET'a sığdırılır
+        context_chunks = search_results.get("context_chunks")
+        if context_chunks is None:
+            context_chunks = [{"text": context, "score": None}] if context else []
+        image_references = search_results.get("image_references") or []
+        messages = build_prompt_messages(
+            lambda ctx: self._build_system_prompt(classification, ctx, has_manual_info, session.product, image_references),
+            context_chunks,
+            session.history[:-1],  # son mesaj bu soru; ayrıca eklenir
+            user_input,
+            session.summary
+        )
+        return messages, classification, search_results, has_manual_info, answer_key
+    
+    def _finish_response(self, ai_response: str, classification: Dict[str, Any], search_results: Dict[str, Any],
+                         has_manual_info: bool, session: ConversationSession,
+                         answer_key: Optional[tuple] = None) -> Dict[str, Any]:
+        # Add to conversation history (message_id geri bildirimi bu yanıta bağlar)
+        message_id = f"msg_{uuid.uuid4().hex}"
+        session.add_message("assistant", ai_response, message_id=message_id)
         
-        try:
-            # Fine-tuned model için optimize edilmiş parametreler
-            # Derin hafıza: Son 8 mesajı bağlama dahil et
-            history_messages = []
-            if self.conversation_history:
-                # Sadece son N mesajı al (token güvenliği için)
-                for m in self.conversation_history[-8:]:
-                    # İçeriği aşırı uzunsa kısalt
-                    content = m.get("content", "")
-                    if isinstance(content, str) and len(content) > 1200:
-                        content = content[:1200] + " …"
-                    history_messages.append({"role": m.get("role", "user"), "content": content})
-
-            messages = [{"role": "system", "content": system_prompt}] + history_messages + [
-                {"role": "user", "content": user_input}
-            ]
-
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",  # Fine-tuned model ID'niz varsa burayı değiştirin
-                messages=messages,
-                temperature=0.1,  # Fine-tuned model için daha düşük
-                max_tokens=800,   # Daha odaklı yanıtlar
-                top_p=0.9,        # Daha deterministik
-                frequency_penalty=0.1  # Tekrar azaltma
-            )
-            
-            ai_response = response.choices[0].message.content
-            
-            # Add to conversation history
-            self.conversation_history.append({"role": "assistant", "content": ai_response})
-            
-            return {
-                "response": ai_response,
+        if answer_key is not None and ai_response.strip():
+            product, question_vec, question = answer_key
+            entry_id = self.answer_cache.put(product, question_vec, question, ai_response, extra={
                 "classification": classification,
-                "product": self.current_product,
                 "has_manual_info": has_manual_info,
-                "search_results": search_results,
-                "success": True
-            }
-            
-        except Exception as e:
-            print(f"AI response error: {e}")
-            return {
-                "response": "Üzgünüm, şu anda teknik bir sorun yaşıyorum. Lütfen tekrar deneyin.",
-                "error": str(e),
-                "success": False
-            }
+                "search_results": search_results
+            })
+            self.answer_cache.link_message(message_id, entry_id)
+        
+        return {
+            "response": ai_response,
+            "message_id": message_id,
+            "classification": classification,
+            "product": session.product,
+            "has_manual_info": has_manual_info,
+            "search_results": search_results,
+            "success": True
+        }
+    
+    def _cached_response(self, cached: Dict[str, Any], session: ConversationSession) -> Dict[str, Any]:
+        message_id = f"msg_{uuid.uuid4().hex}"
+        session.add_message("assistant", cached["answer"], message_id=message_id)
+        self.answer_cache.link_message(message_id, cached["entry_id"])
+        return {
+            "response": cached["answer"],
+            "message_id": message_id,
+            **cached["extra"],
+            "product": session.product,
+            "cached": True,
+            "success": True
+        }
+    
+    @staticmethod
+    def _error_response(e: Exception) -> Dict[str, Any]:
+        print(f"AI response error: {e}")
+        return {
+            "response": "Üzgünüm, şu anda teknik bir sorun yaşıyorum. Lütfen tekrar deneyin.",
+            "error": str(e),
+            "success": False
+        }
 
     def _ask_for_product_clarification(self) -> Dict[str, Any]:
         """Kullanıcıdan ürün adını/cihazı netleştirmesini ister."""
@@ -374,9 +572,9 @@ class TechnicalSupportAI:
     def _detect_product_from_text(self, text: str) -> Optional[str]:
         """Kullanıcı mesajından bilinen bir ürün adını yakalamaya çalışır."""
         try:
-            text_l = (text or "").lower()
+            text_l = normalize(text or "")
             for product in self.multi_manual.get_all_products():
-                name = (product.get("product_name") or "").lower()
+                name = normalize(product.get("product_name") or "")
                 if not name:
                     continue
                 if name in text_l:
@@ -390,16 +588,17 @@ class TechnicalSupportAI:
         except Exception:
             return None
     
-    def _build_system_prompt(self, classification: Dict, context: str, has_manual_info: bool) -> str:
+    def _build_system_prompt(self, classification: Dict, context: str, has_manual_info: bool,
+                             product: Optional[str] = None, image_references: Optional[List[str]] = None) -> str:
         """Build system prompt for fine-tuned AI"""
         
         # Seçilen ürüne göre özelleştirilmiş prompt
         product_context = ""
-        if self.current_product:
+        if product:
             product_context = f"""
-SEÇİLEN ÜRÜN: {self.current_product}
+SEÇİLEN ÜRÜN: {product}
 - Bu ürün hakkında özel uzmanlığın var
-- Sadece {self.current_product} ile ilgili sorulara odaklan
+- Sadece {product} ile ilgili sorulara odaklan
 - Diğer ürünlerle karıştırma
 """
         
@@ -429,8 +628,8 @@ ESİT ÜRÜN PORTFÖYÜ:
         if has_manual_info:
             # Fine-tuned model için ek bağlam
             image_info = ""
-            if "image_references" in search_results and search_results["image_references"]:
-                image_info = f"\nİlgili Görseller: {', '.join(search_results['image_references'])}"
+            if image_references:
+                image_info = f"\nİlgili Görseller: {', '.join(image_references)}"
             
             prompt = f"""{base_prompt}
 
@@ -450,16 +649,16 @@ Eğer tam emin değilsen, genel teknik yaklaşımları öner ama asla başka yer
 
         return prompt
     
-    def reset_conversation(self):
+    def reset_conversation(self, session: Optional[ConversationSession] = None):
         """Reset conversation history and product selection"""
-        self.conversation_history = []
-        self.current_product = None
+        (session or self._default_session).reset()
     
-    def get_conversation_summary(self) -> Dict[str, Any]:
+    def get_conversation_summary(self, session: Optional[ConversationSession] = None) -> Dict[str, Any]:
         """Get conversation summary"""
+        history = (session or self._default_session).history
         return {
-            "total_messages": len(self.conversation_history),
-            "last_message": self.conversation_history[-1] if self.conversation_history else None
+            "total_messages": len(history),
+            "last_message": history[-1] if history else None
         }
 
 
@@ -0,0 +1,163 @@
+"""
+Semantic answer cache in front of the LLM.
+
+Answers are stored per product together with the L2-normalised embedding of the question. A new
+question reuses a cached answer when its cosine similarity to a stored question of the same product
+reaches the threshold, so "kalibrasyon nasıl yapılır" and "Kalibrasyonu nasıl yaparım?" share one
+completion. Entries expire after a TTL and the least recently used are evicted past maxsize.
+Every answer served from an entry gets its own message id; negative feedback on any of them
+evicts the entry.
+
+The cache lives in the worker process: with WEB_CONCURRENCY > 1 every worker holds its own
+entries and message ids. Feedback may reach a worker that never saw the message id, so it is
+also evicted by product and question (evict_question), which any worker can match; copies in
+the other workers remain until their TTL.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+DEFAULT_ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2000"))
+DEFAULT_ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+DEFAULT_ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+MESSAGE_IDS_PER_ANSWER = 10  # maxsize katı; geri bildirim için tutulan mesaj kimlikleri
+
+
+class _ProductBucket:
+    """Question vectors of one product stacked into a matrix, rebuilt only after a change."""
+
+    def __init__(self):
+        self.entry_ids: list = []
+        self.vectors: Dict[int, np.ndarray] = {}
+        self._matrix: Optional[np.ndarray] = None
+
+    def add(self, entry_id: int, vec: np.ndarray) -> None:
+        self.vectors[entry_id] = vec
+        self._matrix = None
+
+    def remove(self, entry_id: int) -> None:
+        if self.vectors.pop(entry_id, None) is not None:
+            self._matrix = None
+
+    def best(self, vec: np.ndarray):
+        """(similarity, entry id) of the closest stored question, or (-1, None)."""
+        if not self.vectors:
+            return -1.0, None
+        sims = self._similarities(vec)
+        pos = int(np.argmax(sims))
+        return float(sims[pos]), self.entry_ids[pos]
+
+    def similar(self, vec: np.ndarray, threshold: float) -> list:
+        """Ids of every stored question whose similarity reaches threshold."""
+        if not self.vectors:
+            return []
+        sims = self._similarities(vec)
+        return [self.entry_ids[i] for i in np.flatnonzero(sims >= threshold)]
+
+    def _similarities(self, vec: np.ndarray) -> np.ndarray:
+        if self._matrix is None:
+            self.entry_ids = list(self.vectors)
+            self._matrix = np.stack([self.vectors[i] for i in self.entry_ids])
+        return self._matrix @ vec
+
+
+class SemanticAnswerCache:
+    def __init__(self, encode: Callable[[str], np.ndarray], maxsize: int = DEFAULT_ANSWER_CACHE_SIZE,
+                 ttl: float = DEFAULT_ANSWER_CACHE_TTL, threshold: float = DEFAULT_ANSWER_CACHE_THRESHOLD):
+        """encode maps a question to an L2-normalised vector; maxsize <= 0 disables the cache."""
+        self.encode = encode
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._buckets: Dict[str, _ProductBucket] = {}
+        self._by_message: "OrderedDict[str, int]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def question_vector(self, question: str) -> np.ndarray:
+        return np.asarray(self.encode(question), dtype="float32").reshape(-1)
+
+    def _drop(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            self._buckets[entry["product"]].remove(entry_id)
+
+    def lookup(self, product: str, vec: np.ndarray) -> Optional[Dict[str, Any]]:
+        """Cached entry ({"question", "answer", ...}) for a similar question of product, or None."""
+        if self.maxsize <= 0:
+            return None
+        with self._lock:
+            bucket = self._buckets.get(product)
+            sim, entry_id = bucket.best(vec) if bucket else (-1.0, None)
+            if entry_id is not None and sim >= self.threshold:
+                entry = self._entries[entry_id]
+                if self.ttl <= 0 or time.monotonic() - entry["created"] < self.ttl:
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return dict(entry, entry_id=entry_id, similarity=sim)
+                self._drop(entry_id)
+            self.misses += 1
+            return None
+
+    def put(self, product: str, vec: np.ndarray, question: str, answer: str, extra: Optional[Dict[str, Any]] = None) -> Optional[int]:
+        """Store an answer; extra holds response fields replayed on a hit. Returns the entry id."""
+        if self.maxsize <= 0:
+            return None
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {"product": product, "question": question, "answer": answer,
+                                       "extra": extra or {}, "created": time.monotonic()}
+            self._buckets.setdefault(product, _ProductBucket()).add(entry_id, vec)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+            return entry_id
+
+    def link_message(self, message_id: str, entry_id: Optional[int]) -> None:
+        """Remember that message_id was answered from entry_id, for feedback eviction."""
+        if entry_id is None or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._by_message[message_id] = entry_id
+            while len(self._by_message) > self.maxsize * MESSAGE_IDS_PER_ANSWER:
+                self._by_message.popitem(last=False)
+
+    def evict_message(self, message_id: str) -> bool:
+        """Drop the entry that produced message_id; True when an entry was removed."""
+        with self._lock:
+            entry_id = self._by_message.pop(message_id, None)
+            if entry_id is None or entry_id not in self._entries:
+                return False
+            self._drop(entry_id)
+            return True
+
+    def evict_question(self, product: str, question: str) -> int:
+        """Drop every entry of product that lookup() would serve for question; returns how many."""
+        if self.maxsize <= 0:
+            return 0
+        vec = self.question_vector(question)
+        with self._lock:
+            bucket = self._buckets.get(product)
+            entry_ids = bucket.similar(vec, self.threshold) if bucket else []
+            for entry_id in entry_ids:
+                self._drop(entry_id)
+            return len(entry_ids)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,122 @@
+"""
+Lexical BM25 inverted index stored next to a FAISS index directory.
+
+Postings are kept as CSR arrays (term offsets, doc ids, term frequencies) in bm25.npz with the
+vocabulary in bm25.vocab.json, so a lookup touches only the postings of the query terms. Used to
+catch exact model numbers and error codes ("Err 04", "PWI") the embedding search misses, fused
+with the vector ranking by reciprocal rank fusion, and as the search path when FAISS is missing.
+"""
+
+import os
+import json
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from text_normalize import tokenize, TOKENIZER_VERSION
+
+VOCAB_FILE = "bm25.vocab.json"
+POSTINGS_FILE = "bm25.npz"
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+
+def write_bm25(texts: Sequence[str], out_dir: str, k1: float = BM25_K1, b: float = BM25_B) -> None:
+    """Build the inverted index over texts (doc id = position, matching the FAISS ids)."""
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    doc_lens = np.zeros(len(texts), dtype="int32")
+    for doc_id, text in enumerate(texts):
+        counts = Counter(tokenize(text or ""))
+        doc_lens[doc_id] = sum(counts.values())
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((doc_id, tf))
+
+    vocab = sorted(postings)
+    offsets = np.zeros(len(vocab) + 1, dtype="int64")
+    for i, term in enumerate(vocab):
+        offsets[i + 1] = offsets[i] + len(postings[term])
+    doc_ids = np.fromiter((d for term in vocab for d, _ in postings[term]), dtype="int32", count=int(offsets[-1]))
+    tfs = np.fromiter((tf for term in vocab for _, tf in postings[term]), dtype="int32", count=int(offsets[-1]))
+
+    # Replaced atomically like the FAISS files, so a running searcher never reads a half-written index
+    os.makedirs(out_dir, exist_ok=True)
+    npz_path = os.path.join(out_dir, POSTINGS_FILE)
+    with open(f"{npz_path}.tmp", "wb") as f:
+        np.savez(f, offsets=offsets, doc_ids=doc_ids, tfs=tfs, doc_lens=doc_lens)
+    os.replace(f"{npz_path}.tmp", npz_path)
+    vocab_path = os.path.join(out_dir, VOCAB_FILE)
+    with open(f"{vocab_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"tokenizer_version": TOKENIZER_VERSION, "k1": k1, "b": b, "terms": vocab}, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(f"{vocab_path}.tmp", vocab_path)
+
+
+class BM25Index:
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, VOCAB_FILE), "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        self.tokenizer_version = vocab.get("tokenizer_version", 0)
+        self.k1 = float(vocab["k1"])
+        self.b = float(vocab["b"])
+        self.term_ids = {term: i for i, term in enumerate(vocab["terms"])}
+        with np.load(os.path.join(index_dir, POSTINGS_FILE)) as data:
+            self.offsets = data["offsets"]
+            self.doc_ids = data["doc_ids"]
+            self.tfs = data["tfs"].astype("float32")
+            doc_lens = data["doc_lens"].astype("float32")
+        self.num_docs = len(doc_lens)
+        avgdl = float(doc_lens.mean()) if self.num_docs else 0.0
+        # Per-document length normalisation is query independent, so it is paid once here
+        self.length_norm = self.k1 * (1.0 - self.b + self.b * doc_lens / avgdl) if avgdl > 0 else np.full(self.num_docs, self.k1, dtype="float32")
+
+    def search(self, query: str, top_k: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(scores, doc ids) of the best-matching documents, best first; only docs with a hit are returned.
+
+        allowed is an optional boolean mask over doc ids restricting the candidates.
+        """
+        scores = np.zeros(self.num_docs, dtype="float32")
+        for term in set(tokenize(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            ids, tf = self.doc_ids[start:end], self.tfs[start:end]
+            df = end - start
+            idf = np.log(1.0 + (self.num_docs - df + 0.5) / (df + 0.5))
+            scores[ids] += idf * tf * (self.k1 + 1.0) / (tf + self.length_norm[ids])
+        if allowed is not None:
+            scores[~allowed] = 0.0
+        hits = np.flatnonzero(scores > 0)
+        if hits.size > top_k:
+            hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return scores[hits], hits
+
+
+def load_bm25(index_dir: str) -> Optional[BM25Index]:
+    """The directory's BM25 index, or None when it is missing or was built with another tokenizer."""
+    if not os.path.exists(os.path.join(index_dir, VOCAB_FILE)):
+        return None
+    try:
+        index = BM25Index(index_dir)
+    except Exception as e:
+        print(f"⚠️ BM25 index unavailable ({index_dir}): {e}")
+        return None
+    if index.tokenizer_version != TOKENIZER_VERSION:
+        print(f"⚠️ BM25 index at {index_dir} uses an older tokenizer; re-run ingestion to rebuild it")
+        return None
+    return index
+
+
+def reciprocal_rank_fusion(rankings: Sequence[np.ndarray], k: int = RRF_K) -> Tuple[np.ndarray, np.ndarray]:
+    """Fuse best-first id rankings by sum(1 / (k + rank)); returns (scores, ids), best first."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            doc_id = int(doc_id)
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    ordered = sorted(fused.items(), key=lambda x: x[1], reverse=True)
+    ids = np.asarray([d for d, _ in ordered], dtype="int64")
+    scores = np.asarray([s for _, s in ordered], dtype="float32")
+    return scores, ids
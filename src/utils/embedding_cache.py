@@ -0,0 +1,122 @@
+"""
+Content-addressed on-disk embedding cache shared by ingestion and query-time encoding.
+
+Vectors are stored in a SQLite file keyed by sha256(model name + input bytes), so identical
+chunk text or image bytes are only ever encoded once per model.
+"""
+
+import os
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = str(Path(__file__).resolve().parents[2] / "data" / "processed" / "embedding_cache.sqlite")
+
+
+class EmbeddingCache:
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Several ingestion workers may share the file; WAL lets readers proceed while one writes
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name: str, payload: bytes) -> str:
+        h = hashlib.sha256(model_name.encode("utf-8"))
+        h.update(b"\0")
+        h.update(payload)
+        return h.hexdigest()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype="float32")
+        return found
+
+    def put_many(self, entries: Dict[str, np.ndarray]) -> None:
+        if not entries:
+            return
+        rows = [(k, np.ascontiguousarray(v, dtype="float32").tobytes()) for k, v in entries.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_pid: Optional[int] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Process-wide cache instance; EMBEDDING_CACHE_PATH="" disables caching."""
+    global _cache, _cache_pid
+    path = os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH)
+    if not path:
+        return None
+    with _cache_lock:
+        # SQLite connections must not cross a fork, so pool workers open their own
+        if _cache is None or _cache_pid != os.getpid() or _cache.path != path:
+            try:
+                _cache = EmbeddingCache(path)
+                _cache_pid = os.getpid()
+            except Exception as e:
+                print(f"⚠️ Embedding cache disabled ({path}): {e}")
+                return None
+        return _cache
+
+
+def cached_encode(model_name: str, inputs: List[Any], payloads: List[bytes],
+                  encode: Callable[[List[Any]], np.ndarray], dim: int = 0, store: bool = True) -> np.ndarray:
+    """Encode inputs with `encode`, serving any input whose payload is already cached.
+
+    `payloads` are the raw bytes identifying each input (UTF-8 text, image file bytes);
+    `dim` is only used to shape the result for empty input. With store=False the cache is
+    only read, so one-off inputs such as user questions do not grow the file.
+    """
+    if not inputs:
+        return np.zeros((0, dim), dtype="float32")
+    cache = get_embedding_cache()
+    if cache is None:
+        return np.asarray(encode(inputs), dtype="float32")
+
+    keys = [EmbeddingCache.make_key(model_name, p) for p in payloads]
+    try:
+        found = cache.get_many(keys)
+    except sqlite3.Error as e:
+        print(f"⚠️ Embedding cache read failed: {e}")
+        found = {}
+
+    missing: Dict[str, int] = {}
+    for i, key in enumerate(keys):
+        if key not in found and key not in missing:
+            missing[key] = i
+    if missing:
+        vectors = np.asarray(encode([inputs[i] for i in missing.values()]), dtype="float32")
+        fresh = dict(zip(missing.keys(), vectors))
+        found.update(fresh)
+        if store:
+            try:
+                cache.put_many(fresh)
+            except sqlite3.Error as e:
+                print(f"⚠️ Embedding cache write failed: {e}")
+
+    return np.stack([found[k] for k in keys]).astype("float32")
@@ -0,0 +1,110 @@
+"""
+Compact, lazily-read metadata for FAISS index directories.
+
+Items are stored one compact JSON object per line in meta.jsonl, with their byte offsets in
+meta.offsets.npy and their page numbers as a column in meta.pages.npy. Readers mmap the
+files and decode an item only when it is accessed, so every worker process shares the same
+page cache instead of holding its own parsed copy. Legacy meta.json directories still load.
+"""
+
+import os
+import json
+import mmap
+from collections.abc import Sequence
+from typing import Any, Dict, List, Union
+
+import numpy as np
+
+JSONL_FILE = "meta.jsonl"
+OFFSETS_FILE = "meta.offsets.npy"
+PAGES_FILE = "meta.pages.npy"
+LEGACY_FILE = "meta.json"
+
+
+def _save_array(path: str, arr: np.ndarray) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+
+def write_meta(items: List[Dict[str, Any]], out_dir: str) -> None:
+    # Each file is replaced atomically (a running server may have the old ones mmapped), but not the
+    # set: readers check that index.faiss and the meta files agree before using them (search_unified)
+    os.makedirs(out_dir, exist_ok=True)
+    offsets = np.zeros(len(items) + 1, dtype="uint64")
+    jsonl_path = os.path.join(out_dir, JSONL_FILE)
+    with open(f"{jsonl_path}.tmp", "wb") as f:
+        for i, item in enumerate(items):
+            line = json.dumps(item, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+            f.write(line)
+            offsets[i + 1] = offsets[i] + len(line)
+    os.replace(f"{jsonl_path}.tmp", jsonl_path)
+    _save_array(os.path.join(out_dir, OFFSETS_FILE), offsets)
+    _save_array(os.path.join(out_dir, PAGES_FILE), np.asarray([int(it.get("page", -1)) for it in items], dtype="int32"))
+    legacy = os.path.join(out_dir, LEGACY_FILE)
+    if os.path.exists(legacy):
+        os.remove(legacy)
+
+
+class MetaItems(Sequence):
+    """Read-only sequence of metadata items backed by mmapped meta.jsonl."""
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        self._offsets = np.load(os.path.join(index_dir, OFFSETS_FILE), mmap_mode="r")
+        self.pages = np.load(os.path.join(index_dir, PAGES_FILE), mmap_mode="r")
+        jsonl_path = os.path.join(index_dir, JSONL_FILE)
+        self._buf: Union[mmap.mmap, bytes] = b""
+        if os.path.getsize(jsonl_path) > 0:
+            with open(jsonl_path, "rb") as f:
+                self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # False when the files were caught between two writes of the directory
+        self.complete = len(self._buf) == int(self._offsets[-1]) and len(self.pages) == len(self)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        n = len(self)
+        i = int(i)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("meta item index out of range")
+        return json.loads(self._buf[int(self._offsets[i]):int(self._offsets[i + 1])])
+
+
+class LegacyMetaItems(list):
+    """Fully parsed items from an old-style meta.json, with the same `pages` column."""
+
+    complete = True
+
+    def __init__(self, items: List[Dict[str, Any]]):
+        super().__init__(items)
+        self.pages = np.asarray([int(it.get("page", -1)) for it in items], dtype="int32")
+
+
+def load_meta(index_dir: str) -> Sequence:
+    if os.path.exists(os.path.join(index_dir, JSONL_FILE)):
+        return MetaItems(index_dir)
+
+    with open(os.path.join(index_dir, LEGACY_FILE), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if "items" in meta:
+        items = meta["items"]
+    elif "texts" in meta:
+        items = [{"text": t} for t in meta["texts"]]
+    elif "images" in meta:
+        items = [{"path": p} for p in meta["images"]]
+    elif "tables_markdown" in meta:
+        items = [{"markdown": m} for m in meta["tables_markdown"]]
+    else:
+        raise ValueError("Unsupported meta.json schema")
+    return LegacyMetaItems(items)
+
+
+def has_meta(index_dir: str) -> bool:
+    return any(os.path.exists(os.path.join(index_dir, name)) for name in (JSONL_FILE, LEGACY_FILE))
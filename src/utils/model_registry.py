@@ -0,0 +1,46 @@
+"""
+Process-wide registry of SentenceTransformer models.
+
+Each model is loaded lazily on first use and then shared, so ingestion and search
+never pay the load cost twice in one process.
+"""
+
+import os
+import threading
+from typing import Dict, Optional
+
+from sentence_transformers import SentenceTransformer
+
+TEXT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+CLIP_MODEL = "clip-ViT-B-32"
+
+_models: Dict[str, SentenceTransformer] = {}
+_lock = threading.Lock()
+_num_threads: Optional[int] = None
+
+
+def set_num_threads(num_threads: int) -> None:
+    """Pin the torch intra-op thread count used by every model in this process."""
+    global _num_threads
+    _num_threads = max(1, int(num_threads))
+    import torch
+    torch.set_num_threads(_num_threads)
+
+
+def get_model(model_name: str) -> SentenceTransformer:
+    """Return the shared instance of model_name, loading it on first use."""
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+    with _lock:
+        model = _models.get(model_name)
+        if model is None:
+            if _num_threads is None and os.getenv("MODEL_NUM_THREADS"):
+                set_num_threads(int(os.environ["MODEL_NUM_THREADS"]))
+            model = SentenceTransformer(model_name)
+            _models[model_name] = model
+        return model
+
+
+def loaded_models() -> Dict[str, SentenceTransformer]:
+    return dict(_models)
@@ -1,12 +1,15 @@
 import os
 import re
 import json
+import time
+import shutil
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional, Iterator, Iterable, Callable, Set
 
 import numpy as np
 from pypdf import PdfReader
-from sentence_transformers import SentenceTransformer
 import faiss
 
 # New imports for images
@@ -16,7 +19,67 @@ from io import BytesIO
 
 # New imports for tables
 import csv
-import pdfplumber
+
+from bm25_index import write_bm25
+from embedding_cache import cached_encode
+from meta_store import write_meta, load_meta, has_meta
+from model_registry import get_model, set_num_threads, TEXT_MODEL, CLIP_MODEL
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 150
+IMAGE_BATCH_SIZE = 16
+THUMBNAIL_SIZE = 512
+PHASH_MAX_DISTANCE = 4
+TABLE_PAGES_PER_TASK = 8
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+ANN_MIN_VECTORS = 1000
+ANN_MAX_TRAIN_SIZE = 100_000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+MANIFEST_VERSION = 2
+MODALITIES = ("text", "images", "tables")
+
+
+def iter_pdf_pages(doc: "fitz.Document",
+                   page_tables: Optional[Dict[int, List[List[List[Any]]]]] = None) -> Iterator[Dict[str, Any]]:
+    """Walk an open PyMuPDF document once, yielding text, image xrefs and table candidates per page.
+
+    page_tables holds tables already detected per page number (see find_tables_parallel).
+    """
+    for page_index in range(len(doc)):
+        page = doc[page_index]
+        page_num = page_index + 1
+        yield {
+            "page": page_num,
+            "text": page.get_text("text") or "",
+            "image_xrefs": [img[0] for img in page.get_images(full=True)],
+            "tables": page_tables[page_num] if page_tables is not None else _find_page_tables(page),
+        }
+
+
+def _find_page_tables(page: "fitz.Page") -> List[List[List[Any]]]:
+    try:
+        found = page.find_tables()
+    except Exception:
+        return []
+    return dedupe_tables([tab.extract() for tab in found.tables])
+
+
+def dedupe_tables(tables: List[List[List[Any]]]) -> List[List[List[Any]]]:
+    """Drop empty tables and tables whose (whitespace-normalised) cells repeat an earlier one."""
+    unique: List[List[List[Any]]] = []
+    seen: Set[str] = set()
+    for rows in tables:
+        if not rows:
+            continue
+        cells = [["" if c is None else " ".join(str(c).split()) for c in row] for row in rows]
+        if not any(c for row in cells for c in row):
+            continue
+        key = json.dumps(cells, ensure_ascii=False)
+        if key not in seen:
+            seen.add(key)
+            unique.append(rows)
+    return unique
 
 
 def extract_text_pages(pdf_path: str) -> List[str]:
@@ -44,7 +107,7 @@ def save_text(text: str, out_path: str) -> None:
         f.write(text)
 
 
-def split_page_text_into_chunks(text: str, page_num: int, chunk_size: int = 800, chunk_overlap: int = 150) -> List[Dict[str, Any]]:
+def split_page_text_into_chunks(text: str, page_num: int, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> List[Dict[str, Any]]:
     if chunk_overlap >= chunk_size:
         chunk_overlap = max(0, chunk_size // 4)
     words = text.split()
@@ -60,57 +123,246 @@ def split_page_text_into_chunks(text: str, page_num: int, chunk_size: int = 800,
     return chunks
 
 
-def build_faiss_index(embeddings: np.ndarray) -> faiss.Index:
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dim)
+def _pq_subquantizers(dim: int) -> int:
+    # 8 dims per sub-quantizer: 384 -> 48, 512 -> 64
+    for m in (dim // 8, 64, 48, 32, 16, 8):
+        if m > 0 and dim % m == 0:
+            return m
+    return 1
+
+
+def _training_sample(embeddings: np.ndarray, size: int, seed: int = 0) -> np.ndarray:
+    n = embeddings.shape[0]
+    if size >= n:
+        return embeddings
+    rng = np.random.default_rng(seed)
+    return embeddings[np.sort(rng.choice(n, size=size, replace=False))]
+
+
+def build_faiss_index(embeddings: np.ndarray, index_type: str = "flat", nlist: Optional[int] = None,
+                      train_size: Optional[int] = None, seed: int = 0) -> faiss.Index:
+    """Build an inner-product index over L2-normalised embeddings.
+
+    index_type is one of INDEX_TYPES. Collections smaller than ANN_MIN_VECTORS always get an
+    exact flat index. IVF variants are trained on a random sample of at least 39 points per
+    centroid (faiss' own lower bound), capped at ANN_MAX_TRAIN_SIZE.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unsupported index type: {index_type} (expected one of {', '.join(INDEX_TYPES)})")
+    n, dim = embeddings.shape
     faiss.normalize_L2(embeddings)
+
+    if index_type == "flat" or n < ANN_MIN_VECTORS:
+        index = faiss.IndexFlatIP(dim)
+        index.add(embeddings)
+        return index
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        index.add(embeddings)
+        return index
+
+    nlist = nlist or int(np.clip(4 * np.sqrt(n), 1, max(1, n // 39)))
+    quantizer = faiss.IndexFlatIP(dim)
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        min_train = 39 * nlist
+    else:
+        nbits = 8 if n >= 39 * 256 else 6 if n >= 39 * 64 else 4
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_subquantizers(dim), nbits, faiss.METRIC_INNER_PRODUCT)
+        min_train = 39 * max(nlist, 2 ** nbits)
+    sample_size = train_size or min(max(min_train, 50 * nlist), ANN_MAX_TRAIN_SIZE)
+    index.train(_training_sample(embeddings, sample_size, seed))
     index.add(embeddings)
+    index.nprobe = min(nlist, max(8, nlist // 16))
     return index
 
 
-def embed_texts(texts: List[str], model_name: str = "sentence-transformers/all-MiniLM-L6-v2") -> np.ndarray:
-    if not texts:
-        return np.zeros((0, 384), dtype="float32")
-    model = SentenceTransformer(model_name)
-    vectors = model.encode(texts, batch_size=64, show_progress_bar=True, convert_to_numpy=True, normalize_embeddings=False)
-    return vectors.astype("float32")
+def benchmark_index(index: faiss.Index, embeddings: np.ndarray, k: int = 10, num_queries: int = 200, seed: int = 0) -> Dict[str, Any]:
+    """Recall@k against exact search, and per-query latency, across the index's search-time knob.
+
+    Queries are sampled from the (normalised) indexed vectors themselves.
+    """
+    n, dim = embeddings.shape
+    k = min(k, n)
+    queries = _training_sample(embeddings, min(num_queries, n), seed + 1)
+    exact = faiss.IndexFlatIP(dim)
+    exact.add(embeddings)
+    start = time.perf_counter()
+    _, truth = exact.search(queries, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    if isinstance(index, faiss.IndexIVF):
+        param, values, target = "nprobe", [v for v in (1, 2, 4, 8, 16, 32, 64, 128, 256) if v <= index.nlist], index
+    elif isinstance(index, faiss.IndexHNSW):
+        param, values, target = "efSearch", [16, 32, 64, 128, 256], index.hnsw
+    else:
+        param, values, target = None, [None], None
+    configured = getattr(target, param) if target is not None else None
+
+    points: List[Dict[str, Any]] = []
+    for value in values:
+        if target is not None:
+            setattr(target, param, value)
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+        points.append({"param": param, "value": value, "recall_at_k": round(recall, 4), "ms_per_query": round(ms, 4)})
+    if target is not None:
+        setattr(target, param, configured)
+
+    return {
+        "index": type(index).__name__,
+        "ntotal": int(index.ntotal),
+        "k": k,
+        "num_queries": len(queries),
+        "exact_ms_per_query": round(exact_ms, 4),
+        "configured": {param: configured} if param else {},
+        "points": points,
+    }
+
+
+def embed_texts(texts: List[str], model_name: str = TEXT_MODEL) -> np.ndarray:
+    def encode(batch: List[str]) -> np.ndarray:
+        model = get_model(model_name)
+        return model.encode(batch, batch_size=64, show_progress_bar=True, convert_to_numpy=True, normalize_embeddings=False)
+
+    return cached_encode(model_name, texts, [t.encode("utf-8") for t in texts], encode, dim=384)
 
 # ---------------- Image pipeline ----------------
 
+def _dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """Difference hash: a 64-bit perceptual fingerprint that survives re-encoding and rescaling."""
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    px = np.asarray(small, dtype=np.int16)
+    bits = (px[:, 1:] > px[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def iter_unique_images(doc: "fitz.Document", page_xrefs: Iterable[Tuple[int, List[int]]],
+                       out_dir: str) -> Iterator[Tuple[Dict[str, Any], str, Image.Image]]:
+    """Extract each distinct image of a document once, yielding (meta, content digest, thumbnail).
+
+    Images are matched by xref first, then by exact bytes, then by perceptual hash. A repeat
+    only appends its page to the `pages` list of the first occurrence's meta, which the caller
+    still holds, so logos and header graphics are saved and embedded a single time.
+    """
+    by_xref: Dict[int, Dict[str, Any]] = {}
+    by_digest: Dict[str, Dict[str, Any]] = {}
+    phashes: List[Tuple[int, Dict[str, Any]]] = []
+    for page_num, xrefs in page_xrefs:
+        for xref in xrefs:
+            meta = by_xref.get(xref)
+            if meta is None:
+                base_image = doc.extract_image(xref)
+                img_bytes = base_image.get("image")
+                img_ext = base_image.get("ext", "png")
+                digest = hashlib.sha256(img_bytes).hexdigest()
+                meta = by_digest.get(digest)
+                if meta is None:
+                    image = Image.open(BytesIO(img_bytes)).convert("RGB")
+                    phash = _dhash(image)
+                    meta = next((m for h, m in phashes if bin(h ^ phash).count("1") <= PHASH_MAX_DISTANCE), None)
+                    if meta is None:
+                        out_path = os.path.join(out_dir, f"img_{digest[:16]}.{img_ext}")
+                        image.save(out_path, format="PNG" if img_ext.lower() == "png" else "JPEG", optimize=True)
+                        image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+                        meta = {"path": out_path, "page": page_num, "pages": [page_num]}
+                        phashes.append((phash, meta))
+                        by_digest[digest] = by_xref[xref] = meta
+                        yield meta, digest, image
+                        continue
+                    image.close()
+                    by_digest[digest] = meta
+                by_xref[xref] = meta
+            if page_num not in meta["pages"]:
+                meta["pages"].append(page_num)
+
+
+class ImageBatchEmbedder:
+    """Embeds images in fixed-size batches as they are pushed, so at most one batch of
+    thumbnails is held in memory regardless of how many images a manual has."""
+
+    def __init__(self, model_name: str = CLIP_MODEL, batch_size: int = IMAGE_BATCH_SIZE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.items: List[Dict[str, Any]] = []
+        self._chunks: List[np.ndarray] = []
+        self._batch: List[Image.Image] = []
+        self._batch_digests: List[str] = []
+
+    def add(self, meta: Dict[str, Any], digest: str, image: Image.Image) -> None:
+        self.items.append(meta)
+        self._batch.append(image)
+        self._batch_digests.append(digest)
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._batch:
+            return
+        def encode(images: List[Image.Image]) -> np.ndarray:
+            model = get_model(self.model_name)
+            return model.encode(images, batch_size=self.batch_size, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=False)
+        # Thumbnails embed slightly differently from full-size images, so they get their own cache namespace
+        cache_name = f"{self.model_name}@thumb{THUMBNAIL_SIZE}"
+        self._chunks.append(cached_encode(cache_name, self._batch, [d.encode("ascii") for d in self._batch_digests], encode, dim=512))
+        for image in self._batch:
+            image.close()
+        self._batch = []
+        self._batch_digests = []
+
+    def finish(self) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+        self._flush()
+        vectors = np.concatenate(self._chunks) if self._chunks else np.zeros((0, 512), dtype="float32")
+        return self.items, vectors
+
+
+def _page_xrefs(doc: "fitz.Document") -> Iterator[Tuple[int, List[int]]]:
+    for page_index in range(len(doc)):
+        yield page_index + 1, [img[0] for img in doc[page_index].get_images(full=True)]
+
+
 def extract_images_from_pdf(pdf_path: str, out_dir: str) -> List[Dict[str, Any]]:
     os.makedirs(out_dir, exist_ok=True)
     doc = fitz.open(pdf_path)
-    images_meta: List[Dict[str, Any]] = []
-    for page_index in range(len(doc)):
-        page = doc[page_index]
-        images = page.get_images(full=True)
-        for image_index, img in enumerate(images):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            img_bytes = base_image.get("image")
-            img_ext = base_image.get("ext", "png")
-            image = Image.open(BytesIO(img_bytes)).convert("RGB")
-            out_path = os.path.join(out_dir, f"page{page_index+1}_img{image_index+1}.{img_ext}")
-            image.save(out_path, format="PNG" if img_ext.lower() == "png" else "JPEG", optimize=True)
-            images_meta.append({"path": out_path, "page": page_index + 1})
-    doc.close()
+    try:
+        images_meta = [meta for meta, _, _ in iter_unique_images(doc, _page_xrefs(doc), out_dir)]
+    finally:
+        doc.close()
     return images_meta
 
 
-def embed_images(image_paths: List[str], model_name: str = "clip-ViT-B-32") -> np.ndarray:
-    if not image_paths:
-        return np.zeros((0, 512), dtype="float32")
-    model = SentenceTransformer(model_name)
-    images = [Image.open(p).convert("RGB") for p in image_paths]
-    vectors = model.encode(images, batch_size=16, show_progress_bar=True, convert_to_numpy=True, normalize_embeddings=False)
-    return vectors.astype("float32")
+def embed_images(image_paths: List[str], model_name: str = CLIP_MODEL) -> np.ndarray:
+    def encode(paths: List[str]) -> np.ndarray:
+        model = get_model(model_name)
+        images = [Image.open(p).convert("RGB") for p in paths]
+        return model.encode(images, batch_size=IMAGE_BATCH_SIZE, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=False)
+
+    # Read and decode one batch at a time, like ImageBatchEmbedder, instead of every file up front
+    chunks = [np.zeros((0, 512), dtype="float32")]
+    for start in range(0, len(image_paths), IMAGE_BATCH_SIZE):
+        batch = image_paths[start:start + IMAGE_BATCH_SIZE]
+        chunks.append(cached_encode(model_name, batch, [Path(p).read_bytes() for p in batch], encode, dim=512))
+    return np.concatenate(chunks)
 
 
 def persist_faiss(index: faiss.Index, meta: List[Dict[str, Any]], out_dir: str) -> None:
     os.makedirs(out_dir, exist_ok=True)
-    faiss.write_index(index, os.path.join(out_dir, "index.faiss"))
-    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
-        json.dump({"items": meta}, f, ensure_ascii=False, indent=2)
+    index_path = os.path.join(out_dir, "index.faiss")
+    faiss.write_index(index, f"{index_path}.tmp")
+    os.replace(f"{index_path}.tmp", index_path)
+    write_meta(meta, out_dir)
+
+
+def load_faiss(index_dir: str) -> Optional[Tuple[faiss.Index, List[Dict[str, Any]]]]:
+    index_path = os.path.join(index_dir, "index.faiss")
+    if not (os.path.exists(index_path) and has_meta(index_dir)):
+        return None
+    return faiss.read_index(index_path), list(load_meta(index_dir))
 
 # ---------------- Table pipeline ----------------
 
@@ -126,39 +378,164 @@ def table_to_markdown(table_rows: List[List[str]]) -> str:
     return "\n".join(md_lines)
 
 
-def extract_tables_from_pdf(pdf_path: str, out_dir: str) -> Tuple[List[str], List[Dict[str, Any]]]:
-    os.makedirs(out_dir, exist_ok=True)
+def _save_page_tables(page_num: int, tables: List[List[List[Any]]], out_dir: str) -> Tuple[List[str], List[Dict[str, Any]]]:
     csv_paths: List[str] = []
     tables_meta: List[Dict[str, Any]] = []
-    with pdfplumber.open(pdf_path) as pdf:
-        for page_idx, page in enumerate(pdf.pages, start=1):
-            try:
-                tables = []
-                single = page.extract_table()
-                if single:
-                    tables.append(single)
-                multi = page.extract_tables() or []
-                tables.extend([t for t in multi if t])
-                for t_idx, t in enumerate(tables, start=1):
-                    if not t:
-                        continue
-                    csv_path = os.path.join(out_dir, f"page{page_idx}_table{t_idx}.csv")
-                    with open(csv_path, "w", newline="", encoding="utf-8") as f:
-                        writer = csv.writer(f)
-                        for row in t:
-                            writer.writerow(["" if cell is None else str(cell).strip() for cell in row])
-                    csv_paths.append(csv_path)
-                    md = table_to_markdown(t)
-                    tables_meta.append({"markdown": md, "page": page_idx, "csv_path": csv_path})
-            except Exception:
-                continue
+    for t_idx, t in enumerate(tables, start=1):
+        if not t:
+            continue
+        csv_path = os.path.join(out_dir, f"page{page_num}_table{t_idx}.csv")
+        with open(csv_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            for row in t:
+                writer.writerow(["" if cell is None else str(cell).strip() for cell in row])
+        csv_paths.append(csv_path)
+        md = table_to_markdown(t)
+        tables_meta.append({"markdown": md, "page": page_num, "csv_path": csv_path})
+    return csv_paths, tables_meta
+
+
+def _write_tables_json(out_dir: str, csv_paths: List[str], tables_meta: List[Dict[str, Any]]) -> None:
     with open(os.path.join(out_dir, "tables.json"), "w", encoding="utf-8") as jf:
         json.dump({"csv_files": csv_paths, "tables": tables_meta}, jf, ensure_ascii=False, indent=2)
-    return csv_paths, tables_meta
 
 
+def _find_tables_pages(pdf_path: str, page_numbers: List[int]) -> List[Tuple[int, List[List[List[Any]]]]]:
+    doc = fitz.open(pdf_path)
+    try:
+        return [(page_num, _find_page_tables(doc[page_num - 1])) for page_num in page_numbers]
+    finally:
+        doc.close()
 
-def process(pdf_path: str) -> None:
+
+def find_tables_parallel(pdf_path: str, num_pages: int, max_workers: Optional[int] = None) -> Dict[int, List[List[List[Any]]]]:
+    """Table candidates per page number, with ranges of TABLE_PAGES_PER_TASK pages spread over processes."""
+    page_numbers = list(range(1, num_pages + 1))
+    chunks = [page_numbers[i:i + TABLE_PAGES_PER_TASK] for i in range(0, num_pages, TABLE_PAGES_PER_TASK)]
+    workers = max(1, min(max_workers or os.cpu_count() or 1, len(chunks)))
+
+    # Table detection is CPU-bound and by far the slowest part of the page walk
+    if workers == 1:
+        return dict(_find_tables_pages(pdf_path, page_numbers))
+    page_tables: Dict[int, List[List[List[Any]]]] = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(_find_tables_pages, [pdf_path] * len(chunks), chunks):
+            page_tables.update(result)
+    return page_tables
+
+
+def extract_tables_from_pdf(pdf_path: str, out_dir: str, max_workers: Optional[int] = None) -> Tuple[List[str], List[Dict[str, Any]]]:
+    os.makedirs(out_dir, exist_ok=True)
+    doc = fitz.open(pdf_path)
+    num_pages = len(doc)
+    doc.close()
+
+    csv_paths: List[str] = []
+    tables_meta: List[Dict[str, Any]] = []
+    for page_num, tables in sorted(find_tables_parallel(pdf_path, num_pages, max_workers).items()):
+        page_csvs, page_meta = _save_page_tables(page_num, tables, out_dir)
+        csv_paths.extend(page_csvs)
+        tables_meta.extend(page_meta)
+    _write_tables_json(out_dir, csv_paths, tables_meta)
+    return csv_paths, tables_meta
+
+
+# ---------------- Incremental indexing ----------------
+
+def _sha256(*parts: bytes) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(hashlib.sha256(part).digest())
+    return h.hexdigest()
+
+
+def _page_image_hash(doc: "fitz.Document", xrefs: List[int]) -> str:
+    return _sha256(*[doc.xref_stream_raw(x) or b"" for x in xrefs])
+
+
+def _load_manifest(manifest_path: str, index_dirs: Dict[str, str], index_type: str = "flat") -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+    """Load the ingestion manifest and existing indexes, or (None, {}) when a full rebuild is needed."""
+    if not os.path.exists(manifest_path):
+        return None, {}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except Exception:
+        return None, {}
+    expected = {"version": MANIFEST_VERSION, "text_model": TEXT_MODEL, "image_model": CLIP_MODEL,
+                "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+    if any(manifest.get(k) != v for k, v in expected.items()) or manifest.get("index_type", "flat") != index_type:
+        return None, {}
+
+    existing: Dict[str, Any] = {}
+    for modality, index_dir in index_dirs.items():
+        loaded = load_faiss(index_dir)
+        count = manifest.get("counts", {}).get(modality, 0)
+        if loaded is None:
+            if count:
+                return None, {}
+            continue
+        index, items = loaded
+        # Index and metadata must still line up with what the manifest recorded
+        if index.ntotal != len(items) or len(items) != count:
+            return None, {}
+        existing[modality] = loaded
+    return manifest, existing
+
+
+def _stale_pages(old: Dict[str, str], new: Dict[str, str]) -> Set[int]:
+    return {int(p) for p in set(old) | set(new) if old.get(p) != new.get(p)}
+
+
+def _update_index(index_dir: str, existing: Optional[Tuple[faiss.Index, List[Dict[str, Any]]]],
+                  fresh_items: List[Dict[str, Any]], stale_pages: Set[int],
+                  embed: Callable[[List[Dict[str, Any]]], np.ndarray], index_type: str = "flat",
+                  required: bool = False) -> Tuple[List[Dict[str, Any]], int, int]:
+    """Drop the vectors of stale pages from an index, embed and add the fresh items, and persist it.
+
+    Returns the final item list plus the number of removed and added vectors.
+    """
+    index, items = existing if existing is not None else (None, [])
+    drop = [i for i, it in enumerate(items) if int(it.get("page", -1)) in stale_pages] if stale_pages else []
+    if existing is not None and not drop and not fresh_items:
+        return items, 0, 0
+    drop_set = set(drop)
+    kept = [it for i, it in enumerate(items) if i not in drop_set]
+    total = len(kept) + len(fresh_items)
+
+    if total == 0 and not required:
+        shutil.rmtree(index_dir, ignore_errors=True)
+        return [], len(drop), 0
+
+    flat_target = index_type == "flat" or total < ANN_MIN_VECTORS
+    if index is not None and isinstance(index, faiss.IndexFlat) and flat_target:
+        # Flat indexes stay dense on remove_ids, so positions keep matching the item list
+        if drop:
+            index.remove_ids(np.asarray(drop, dtype="int64"))
+        vectors = embed(fresh_items)
+        if vectors.shape[0] > 0:
+            faiss.normalize_L2(vectors)
+            index.add(vectors)
+    else:
+        # ANN indexes cannot be patched in place (HNSW has no remove_ids, IVF keeps stale ids),
+        # so they are rebuilt; kept items come back from the embedding cache
+        vectors = embed(kept + fresh_items) if kept else embed(fresh_items)
+        index = build_faiss_index(vectors, index_type=index_type)
+
+    persist_faiss(index, kept + fresh_items, index_dir)
+    report_path = os.path.join(index_dir, "build_report.json")
+    if not isinstance(index, faiss.IndexFlat):
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(benchmark_index(index, vectors), f, ensure_ascii=False, indent=2)
+    elif os.path.exists(report_path):
+        os.remove(report_path)
+    return kept + fresh_items, len(drop), len(fresh_items)
+
+
+def process(pdf_path: str, incremental: bool = True, index_type: str = "flat", table_workers: Optional[int] = None) -> None:
+    """Index one manual; table_workers processes detect tables (default: CPU count, 1: inline in the page walk)."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unsupported index type: {index_type} (expected one of {', '.join(INDEX_TYPES)})")
     pdf_path = str(Path(pdf_path).expanduser())
     base = Path(pdf_path).with_suffix("")
     txt_path = f"{base}.txt"
@@ -167,50 +544,167 @@ def process(pdf_path: str) -> None:
     image_index_dir = f"{base}_faiss_images"
     tables_dir = f"{base}_tables"
     table_index_dir = f"{base}_faiss_tables"
-
-    # Text pipeline with page-aware chunking
-    page_texts_raw = extract_text_pages(pdf_path)
-    page_texts_clean = [clean_text(t) for t in page_texts_raw]
+    manifest_path = f"{base}_manifest.json"
+    index_dirs = {"text": vectordb_dir, "images": image_index_dir, "tables": table_index_dir}
+    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(tables_dir, exist_ok=True)
+
+    # Pages whose content hash matches the manifest keep their stored vectors
+    manifest, existing = _load_manifest(manifest_path, index_dirs, index_type) if incremental else (None, {})
+    old_hashes: Dict[str, Dict[str, str]] = manifest["pages"] if manifest else {m: {} for m in MODALITIES}
+    new_hashes: Dict[str, Dict[str, str]] = {m: {} for m in MODALITIES}
+    fresh: Dict[str, List[Dict[str, Any]]] = {m: [] for m in MODALITIES}
+
+    # Single pass over the document: text chunks, images and tables per page
+    page_texts_clean: List[str] = []
+    page_xrefs: List[Tuple[int, List[int]]] = []
+    doc = fitz.open(pdf_path)
+    try:
+        page_tables = find_tables_parallel(pdf_path, len(doc), table_workers) if table_workers != 1 else None
+        for page in iter_pdf_pages(doc, page_tables):
+            page_num = page["page"]
+            key = str(page_num)
+            page_text = clean_text(page["text"])
+            page_texts_clean.append(page_text)
+
+            new_hashes["text"][key] = _sha256(page_text.encode("utf-8"))
+            if old_hashes["text"].get(key) != new_hashes["text"][key]:
+                fresh["text"].extend(split_page_text_into_chunks(page_text, page_num=page_num))
+
+            new_hashes["images"][key] = _page_image_hash(doc, page["image_xrefs"])
+            page_xrefs.append((page_num, page["image_xrefs"]))
+
+            new_hashes["tables"][key] = _sha256(json.dumps(page["tables"], ensure_ascii=False).encode("utf-8"))
+            if old_hashes["tables"].get(key) != new_hashes["tables"][key]:
+                fresh["tables"].extend(_save_page_tables(page_num, page["tables"], tables_dir)[1])
+
+        # Images are de-duplicated across the whole manual, so one changed page
+        # re-runs the image stage for every page; unchanged images hit the embedding cache
+        stale = {m: _stale_pages(old_hashes[m], new_hashes[m]) for m in MODALITIES}
+        image_vectors = np.zeros((0, 512), dtype="float32")
+        if stale["images"]:
+            existing.pop("images", None)
+            image_embedder = ImageBatchEmbedder()
+            for meta, digest, image in iter_unique_images(doc, page_xrefs, images_dir):
+                image_embedder.add(meta, digest, image)
+            fresh["images"], image_vectors = image_embedder.finish()
+    finally:
+        doc.close()
     save_text("\n\n".join(page_texts_clean), txt_path)
 
-    text_items: List[Dict[str, Any]] = []
-    for i, page_text in enumerate(page_texts_clean, start=1):
-        chunks = split_page_text_into_chunks(page_text, page_num=i)
-        text_items.extend(chunks)
-    text_vectors = embed_texts([it["text"] for it in text_items])
-    text_index = build_faiss_index(text_vectors)
-    persist_faiss(text_index, text_items, vectordb_dir)
-
-    # Image pipeline
-    image_items = extract_images_from_pdf(pdf_path, images_dir)
-    img_vectors = embed_images([im["path"] for im in image_items])
-    if img_vectors.shape[0] > 0:
-        img_index = build_faiss_index(img_vectors)
-        persist_faiss(img_index, image_items, image_index_dir)
-
-    # Table pipeline
-    _, tables_meta = extract_tables_from_pdf(pdf_path, tables_dir)
-    tbl_vectors = embed_texts([t["markdown"] for t in tables_meta])
-    if tbl_vectors.shape[0] > 0:
-        tbl_index = build_faiss_index(tbl_vectors)
-        persist_faiss(tbl_index, tables_meta, table_index_dir)
+    embedders: Dict[str, Callable[[List[Dict[str, Any]]], np.ndarray]] = {
+        "text": lambda items: embed_texts([it["text"] for it in items]),
+        "images": lambda items: image_vectors,
+        "tables": lambda items: embed_texts([t["markdown"] for t in items]),
+    }
+    final_items: Dict[str, List[Dict[str, Any]]] = {}
+    changes: Dict[str, Dict[str, int]] = {}
+    for modality in MODALITIES:
+        items, removed, added = _update_index(index_dirs[modality], existing.get(modality), fresh[modality],
+                                              stale[modality], embedders[modality], index_type=index_type,
+                                              required=(modality == "text"))
+        final_items[modality] = items
+        changes[modality] = {"stale_pages": len(stale[modality]), "removed": removed, "added": added}
+    # Lexical indexes are cheap to rebuild, so they are always rewritten from the final items
+    for modality, field in (("text", "text"), ("tables", "markdown")):
+        if os.path.isdir(index_dirs[modality]):
+            write_bm25([it.get(field, "") for it in final_items[modality]], index_dirs[modality])
+    _write_tables_json(tables_dir, [t["csv_path"] for t in final_items["tables"]], final_items["tables"])
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "version": MANIFEST_VERSION,
+            "text_model": TEXT_MODEL,
+            "image_model": CLIP_MODEL,
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "index_type": index_type,
+            "pages": new_hashes,
+            "counts": {m: len(final_items[m]) for m in MODALITIES},
+        }, f, ensure_ascii=False)
 
     print(json.dumps({
         "txt_path": txt_path,
+        "mode": "incremental" if manifest else "full",
+        "index_type": index_type,
         "faiss_text_dir": vectordb_dir,
-        "num_text_chunks": len(text_items),
+        "num_text_chunks": len(final_items["text"]),
         "images_dir": images_dir,
         "faiss_image_dir": image_index_dir,
-        "num_images": len(image_items),
+        "num_images": len(final_items["images"]),
         "tables_dir": tables_dir,
         "faiss_table_dir": table_index_dir,
-        "num_tables": len(tables_meta)
+        "num_tables": len(final_items["tables"]),
+        "changes": changes
+    }, ensure_ascii=False))
+
+
+# ---------------- Batch ingestion ----------------
+
+def _process_one(pdf_path: str, incremental: bool = True, index_type: str = "flat") -> Dict[str, Any]:
+    start = time.perf_counter()
+    try:
+        # Manuals already run one per worker process, so tables are detected inline
+        process(pdf_path, incremental=incremental, index_type=index_type, table_workers=1)
+        return {"pdf_path": pdf_path, "success": True, "seconds": round(time.perf_counter() - start, 2)}
+    except Exception as e:
+        return {"pdf_path": pdf_path, "success": False, "seconds": round(time.perf_counter() - start, 2),
+                "error": f"{type(e).__name__}: {e}"}
+
+
+def _init_worker(num_threads: int) -> None:
+    # Split the cores between workers instead of letting every torch pool claim all of them
+    set_num_threads(num_threads)
+
+
+def process_directory(manuals_dir: str, max_workers: Optional[int] = None, incremental: bool = True,
+                      index_type: str = "flat") -> List[Dict[str, Any]]:
+    """Process every PDF in manuals_dir in parallel, one manual per worker process."""
+    pdf_paths = sorted(str(p) for p in Path(manuals_dir).expanduser().glob("*.pdf"))
+    if not pdf_paths:
+        return []
+    workers = max(1, min(max_workers or os.cpu_count() or 1, len(pdf_paths)))
+
+    start = time.perf_counter()
+    reports: List[Dict[str, Any]] = []
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(threads_per_worker,)) as pool:
+        futures = {pool.submit(_process_one, p, incremental, index_type): p for p in pdf_paths}
+        for fut in as_completed(futures):
+            try:
+                report = fut.result()
+            except Exception as e:
+                # Worker died (e.g. killed for memory) before it could report
+                report = {"pdf_path": futures[fut], "success": False, "seconds": None,
+                          "error": f"{type(e).__name__}: {e}"}
+            reports.append(report)
+            status = "ok" if report["success"] else f"FAILED ({report['error']})"
+            # A dead worker reports no time
+            took = f" in {report['seconds']}s" if report["seconds"] is not None else ""
+            print(f"[{len(reports)}/{len(pdf_paths)}] {Path(report['pdf_path']).name}: {status}{took}")
+
+    reports.sort(key=lambda r: r["pdf_path"])
+    print(json.dumps({
+        "manuals_dir": str(manuals_dir),
+        "workers": workers,
+        "total_seconds": round(time.perf_counter() - start, 2),
+        "num_manuals": len(reports),
+        "num_failed": sum(1 for r in reports if not r["success"]),
+        "manuals": reports
     }, ensure_ascii=False))
+    return reports
 
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument("pdf_path", type=str, help="Path to PDF file")
+    parser.add_argument("pdf_path", type=str, help="Path to PDF file, or a directory of PDFs to process in parallel")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes: one manual each in directory mode, table detection for a single PDF (default: CPU count)")
+    parser.add_argument("--full", action="store_true", help="Ignore the ingestion manifest and rebuild every index")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat",
+                        help="FAISS index type; ANN types fall back to flat below %d vectors" % ANN_MIN_VECTORS)
     args = parser.parse_args()
-    process(args.pdf_path)
+    if Path(args.pdf_path).expanduser().is_dir():
+        process_directory(args.pdf_path, max_workers=args.workers, incremental=not args.full, index_type=args.index_type)
+    else:
+        process(args.pdf_path, incremental=not args.full, index_type=args.index_type, table_workers=args.workers)
@@ -0,0 +1,85 @@
+"""
+Bounded in-memory LRU cache with a TTL and hit/miss counters, for repeated support queries.
+
+Entries belong to a "generation" (e.g. the mtimes of the index files they were computed from);
+reading with a different generation clears the cache, so a rebuilt index never serves stale results.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+DEFAULT_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+DEFAULT_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "3600"))
+
+_MISSING = object()
+
+
+class QueryCache:
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE, ttl: float = DEFAULT_CACHE_TTL):
+        """maxsize <= 0 disables the cache; ttl is in seconds (<= 0: no expiry)."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._generation: Any = None
+        self._lock = threading.Lock()
+
+    def _check_generation(self, generation: Any) -> None:
+        if generation is not None and generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+    def get(self, key: Hashable, generation: Any = None, default: Any = None) -> Any:
+        if self.maxsize <= 0:
+            return default
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and (self.ttl <= 0 or time.monotonic() - entry[0] < self.ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any, generation: Any = None) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._check_generation(generation)
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def file_generation(*paths: str) -> tuple:
+    """(mtime_ns, size) of each path, None for missing ones: changes whenever a file is replaced."""
+    generation = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            generation.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            generation.append(None)
+    return tuple(generation)
@@ -5,11 +5,11 @@ Multi-manual search system that can search across all processed user manuals.
 
 import os
 import json
+import heapq
 import logging
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import Dict, List, Any, Tuple, Optional
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
 # Try to import faiss, fallback to simple search if not available
 try:
@@ -19,21 +19,43 @@ except ImportError:
     FAISS_AVAILABLE = False
     print("⚠️ FAISS not available, using simple search fallback")
 
-from search_unified import ModalityIndex
+from model_registry import get_model, TEXT_MODEL, CLIP_MODEL
+from query_cache import QueryCache, file_generation
+from search_unified import (UnifiedSearcher, TEXT_MODALITIES, encode_normalized_query, fuse_page_scores,
+                            plan_modalities, query_cache_key, query_vector_cache_stats)
+from unified_index import UNIFIED_INDEX_DIRNAME, MANIFEST_FILE, load_unified_index
+
+# Same fusion weights as UnifiedSearcher's defaults
+MODALITY_WEIGHTS = {"text": 1.0, "tables": 1.0, "images": 1.5}
+# Page keys in the merged index are product_id * PAGE_KEY_STRIDE + page
+PAGE_KEY_STRIDE = 1 << 20
 
 
 class MultiManualSearcher:
-    def __init__(self, metadata_file: str = "manuals_metadata.json"):
+    def __init__(self, metadata_file: str = "manuals_metadata.json", unified_index_dir: Optional[str] = None,
+                 search_workers: int = 0, search_timeout: Optional[float] = None):
+        """search_workers > 0 fans per-manual searches out over a thread pool (FAISS releases the GIL);
+        search_timeout is the default per-call deadline in seconds for that fan-out."""
         self.metadata_file = metadata_file
         self.manuals_data = self._load_metadata()
-        self.text_model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-        self.clip_model = SentenceTransformer("clip-ViT-B-32")
+        self.text_model = get_model(TEXT_MODEL)
         
         # Load all manual indices
         self.manual_searchers = self._load_manual_searchers()
         
+        self.search_timeout = search_timeout
+        self._pool = ThreadPoolExecutor(max_workers=search_workers, thread_name_prefix="manual-search") if search_workers > 0 else None
+        
+        # Merged cross-manual index (unified_index.py); per-manual search is the fallback
+        self.unified_index_dir = unified_index_dir or os.path.join(os.path.dirname(os.path.abspath(metadata_file)), UNIFIED_INDEX_DIRNAME)
+        self._unified_generation = file_generation(os.path.join(self.unified_index_dir, MANIFEST_FILE))
+        self.unified_index = load_unified_index(self.unified_index_dir) if FAISS_AVAILABLE else None
+        # Merged-index results keyed on (normalised query, product filter, top_k)
+        self._result_cache = QueryCache()
+        
         logger = logging.getLogger(__name__)
-        logger.info(f"Loaded {len(self.manual_searchers)} manual searchers")
+        logger.info(f"Loaded {len(self.manual_searchers)} manual searchers"
+                    + (" and the unified index" if self.unified_index else ""))
     
     def _load_metadata(self) -> Dict[str, Any]:
         """Load manuals metadata"""
@@ -52,8 +74,8 @@ class MultiManualSearcher:
                 pdf_path = manual["pdf_path"]
                 product_name = manual["product_info"]["product_name"]
                 
-                # Create searcher for this manual
-                searcher = UnifiedSearcher(pdf_path)
+                # Create searcher for this manual, sharing the process-wide models
+                searcher = UnifiedSearcher(pdf_path, text_model=self.text_model)
                 searchers[product_name] = {
                     "searcher": searcher,
                     "product_info": manual["product_info"],
@@ -65,110 +87,275 @@ class MultiManualSearcher:
         
         return searchers
     
+    def _refresh_unified_index(self) -> None:
+        """Pick up a rebuilt merged index (its manifest is replaced last, after every modality) and
+        drop it once a source manual is re-indexed after the merge."""
+        if not FAISS_AVAILABLE:
+            return
+        generation = file_generation(os.path.join(self.unified_index_dir, MANIFEST_FILE))
+        if generation != self._unified_generation:
+            self._unified_generation = generation
+            self.unified_index = load_unified_index(self.unified_index_dir)
+        elif self.unified_index is not None and self.unified_index.is_stale():
+            # Per-manual searchers reload the re-ingested manual; the merged copy would serve old chunks
+            print(f"⚠️ Unified index at {self.unified_index_dir} is older than its manuals; using per-manual search")
+            self.unified_index = None
+            self._result_cache.clear()
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters of the merged-index, per-manual and query-vector caches"""
+        return {
+            "results": self._result_cache.stats(),
+            "query_vectors": query_vector_cache_stats(),
+            "manuals": {name: data["searcher"].cache_stats()["results"] for name, data in self.manual_searchers.items()}
+        }
+    
+    @property
+    def clip_model(self):
+        # Loaded on the first search that actually plans an image modality
+        return get_model(CLIP_MODEL)
+    
+    def _encode_query(self, query: str, available: Tuple[str, ...],
+                      modalities: Optional[List[str]] = None) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """Encode the query once for all manuals, only with the models the planned modalities need"""
+        if not FAISS_AVAILABLE:
+            return None, None
+        plan = plan_modalities(available, modalities)
+        q_text_vec = encode_normalized_query(self.text_model, TEXT_MODEL, query) if any(m in plan for m in TEXT_MODALITIES) else None
+        q_clip_vec = encode_normalized_query(self.clip_model, CLIP_MODEL, query) if "images" in plan else None
+        return q_text_vec, q_clip_vec
+    
     def search_all_manuals(self, query: str, top_k: int = 10, 
-                          w_text: float = 1.0, w_tables: float = 1.0, w_images: float = 1.5) -> Dict[str, Any]:
-        """Search across all manuals and return unified results"""
+                          w_text: float = 1.0, w_tables: float = 1.0, w_images: float = 1.5,
+                          timeout: Optional[float] = None, modalities: Optional[List[str]] = None,
+                          product_names: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Search across all manuals and return unified results; modalities restricts the searched indexes
+        and product_names the searched manuals"""
         
-        all_results = []
+        self._refresh_unified_index()
+        if self.unified_index is not None:
+            product_ids = self.unified_index.product_ids_for(product_names=product_names) if product_names is not None else None
+            if product_ids == []:
+                return {"error": f"No manuals found for products: {', '.join(product_names)}"}
+            return self._search_unified(query, top_k, product_ids, modalities)
         
-        for product_name, searcher_data in self.manual_searchers.items():
-            try:
-                searcher = searcher_data["searcher"]
-                product_info = searcher_data["product_info"]
-                
-                # Search this manual
-                results = searcher.search(query, top_k=top_k)
-                
-                # Add product context to results
-                for modality in ["text", "tables", "images"]:
-                    for item in results["by_modality"][modality]:
-                        item["product_name"] = product_name
-                        item["product_category"] = product_info["product_category"]
-                        item["pdf_path"] = searcher_data["pdf_path"]
-                
-                # Add product context to page results
-                for page_result in results["by_page"]:
-                    page_result["product_name"] = product_name
-                    page_result["product_category"] = product_info["product_category"]
-                    page_result["pdf_path"] = searcher_data["pdf_path"]
-                
-                all_results.append({
-                    "product_name": product_name,
-                    "product_info": product_info,
-                    "results": results
-                })
-                
-            except Exception as e:
-                logging.error(f"Search failed for {product_name}: {e}")
+        manuals = self.manual_searchers
+        if product_names is not None:
+            manuals = {name: data for name, data in manuals.items() if name in product_names}
+            if not manuals:
+                return {"error": f"No manuals found for products: {', '.join(product_names)}"}
+        
+        all_results, timed_out = self._search_manuals(query, manuals, top_k, timeout, modalities)
         
         # Merge and rank results across all manuals
-        return self._merge_results(all_results, top_k)
+        merged = self._merge_results(all_results, top_k)
+        merged["timed_out_manuals"] = timed_out
+        return merged
+    
+    def _search_manuals(self, query: str, manuals: Dict[str, Any], top_k: int, timeout: Optional[float] = None,
+                        modalities: Optional[List[str]] = None) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Search each manual with one shared query encoding; results stay unannotated until merged.
+        
+        With a thread pool, manuals that miss the deadline are dropped and returned by name.
+        """
+        available = tuple({m for data in manuals.values() for m in data["searcher"].available_modalities})
+        q_text_vec, q_clip_vec = self._encode_query(query, available, modalities)
+        
+        def search_one(searcher_data: Dict[str, Any]) -> Dict[str, Any]:
+            return searcher_data["searcher"].search(query, top_k=top_k, q_text_vec=q_text_vec, q_clip_vec=q_clip_vec,
+                                                    modalities=modalities)
+        
+        outcomes: Dict[str, Any] = {}
+        timed_out: List[str] = []
+        if self._pool is None:
+            for product_name, searcher_data in manuals.items():
+                try:
+                    outcomes[product_name] = search_one(searcher_data)
+                except Exception as e:
+                    logging.error(f"Search failed for {product_name}: {e}")
+        else:
+            futures = {product_name: self._pool.submit(search_one, searcher_data) for product_name, searcher_data in manuals.items()}
+            wait(futures.values(), timeout=timeout if timeout is not None else self.search_timeout)
+            for product_name, future in futures.items():
+                if not future.done():
+                    # Late manuals are dropped; a search that already started finishes in the background
+                    future.cancel()
+                    timed_out.append(product_name)
+                elif future.exception() is not None:
+                    logging.error(f"Search failed for {product_name}: {future.exception()}")
+                else:
+                    outcomes[product_name] = future.result()
+            if timed_out:
+                logging.warning(f"Manual search deadline missed, dropped: {', '.join(timed_out)}")
+        
+        # Keep the manuals' own order so score ties merge the same way with or without the pool
+        all_results = [{
+            "product_name": product_name,
+            "product_info": manuals[product_name]["product_info"],
+            "pdf_path": manuals[product_name]["pdf_path"],
+            "results": results
+        } for product_name, results in outcomes.items()]
+        return all_results, timed_out
+    
+    @staticmethod
+    def _with_context(item: Dict[str, Any], manual_result: Dict[str, Any]) -> Dict[str, Any]:
+        # Per-manual results may be shared through the searchers' result caches, so annotate a copy
+        return {
+            **item,
+            "product_name": manual_result["product_name"],
+            "product_category": manual_result["product_info"]["product_category"],
+            "pdf_path": manual_result["pdf_path"]
+        }
     
     def _merge_results(self, all_results: List[Dict[str, Any]], top_k: int) -> Dict[str, Any]:
-        """Merge results from all manuals and rank them"""
+        """Merge results from all manuals: streaming top-k per list, per-product counts in the same pass"""
         
-        merged_text = []
-        merged_tables = []
-        merged_images = []
-        merged_pages = []
+        # Heap entries are (score, seq, manual index, result); seq breaks ties without comparing dicts
+        heaps: Dict[str, List[Tuple[float, int, int, Dict[str, Any]]]] = {m: [] for m in ("text", "tables", "images", "pages")}
+        by_product = {}
+        seq = 0
         
-        # Collect all results
-        for manual_result in all_results:
+        for manual_idx, manual_result in enumerate(all_results):
             results = manual_result["results"]
+            counts = {}
+            streams = [(m, results["by_modality"][m]) for m in ("text", "tables", "images")] + [("pages", results["by_page"])]
+            for name, stream in streams:
+                heap = heaps[name]
+                relevant = 0
+                for r in stream:
+                    score = r["score"]
+                    if score > 0.1:
+                        relevant += 1
+                    seq += 1
+                    entry = (score, -seq, manual_idx, r)
+                    if len(heap) < top_k:
+                        heapq.heappush(heap, entry)
+                    elif entry > heap[0]:
+                        heapq.heapreplace(heap, entry)
+                counts[name] = relevant
             
-            merged_text.extend(results["by_modality"]["text"])
-            merged_tables.extend(results["by_modality"]["tables"])
-            merged_images.extend(results["by_modality"]["images"])
-            merged_pages.extend(results["by_page"])
+            by_product[manual_result["product_name"]] = {
+                "product_info": manual_result["product_info"],
+                "relevant_results": {
+                    "text": counts["text"],
+                    "tables": counts["tables"],
+                    "images": counts["images"],
+                    "total": counts["text"] + counts["tables"] + counts["images"]
+                },
+                "top_pages": [self._with_context(p, manual_result) for p in results["by_page"][:3]]  # Top 3 pages from this product
+            }
         
-        # Sort by score and limit
-        merged_text = sorted(merged_text, key=lambda x: x["score"], reverse=True)[:top_k]
-        merged_tables = sorted(merged_tables, key=lambda x: x["score"], reverse=True)[:top_k]
-        merged_images = sorted(merged_images, key=lambda x: x["score"], reverse=True)[:top_k]
-        merged_pages = sorted(merged_pages, key=lambda x: x["score"], reverse=True)[:top_k]
+        # Only the winners get product context attached
+        merged = {
+            name: [self._with_context(r, all_results[manual_idx]) for _, _, manual_idx, r in sorted(heap, reverse=True)]
+            for name, heap in heaps.items()
+        }
         
         return {
             "by_modality": {
-                "text": merged_text,
-                "tables": merged_tables,
-                "images": merged_images
+                "text": merged["text"],
+                "tables": merged["tables"],
+                "images": merged["images"]
             },
-            "by_page": merged_pages,
-            "by_product": self._group_by_product(all_results),
+            "by_page": merged["pages"],
+            "by_product": by_product,
             "total_manuals_searched": len(all_results),
-            "weights": {"text": 1.0, "tables": 1.0, "images": 1.5}
+            "weights": dict(MODALITY_WEIGHTS)
         }
     
-    def _group_by_product(self, all_results: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Group results by product for easier analysis"""
-        product_groups = {}
+    def _search_unified(self, query: str, top_k: int, product_ids: Optional[List[int]],
+                        modalities: Optional[List[str]] = None) -> Dict[str, Any]:
+        """One filtered top-k per modality over the merged index, in _merge_results' output shape"""
+        plan = plan_modalities(tuple(self.unified_index.modalities), modalities)
+        key = (query_cache_key(query), tuple(product_ids) if product_ids is not None else None, top_k, plan)
+        cached = self._result_cache.get(key, self._unified_generation)
+        if cached is not None:
+            return cached
+        result = self._search_unified_uncached(query, top_k, product_ids, plan)
+        self._result_cache.put(key, result, self._unified_generation)
+        return result
+    
+    def _search_unified_uncached(self, query: str, top_k: int, product_ids: Optional[List[int]],
+                                 plan: Tuple[str, ...]) -> Dict[str, Any]:
+        index = self.unified_index
+        q_text_vec, q_clip_vec = self._encode_query(query, plan)
+        query_vecs = {"text": q_text_vec, "tables": q_text_vec, "images": q_clip_vec}
+        fields = {"text": ("text",), "tables": ("markdown", "csv_path"), "images": ("path",)}
         
-        for manual_result in all_results:
-            product_name = manual_result["product_name"]
-            product_info = manual_result["product_info"]
-            results = manual_result["results"]
-            
-            # Count relevant results for this product
-            text_count = len([r for r in results["by_modality"]["text"] if r["score"] > 0.1])
-            table_count = len([r for r in results["by_modality"]["tables"] if r["score"] > 0.1])
-            image_count = len([r for r in results["by_modality"]["images"] if r["score"] > 0.1])
-            
-            product_groups[product_name] = {
-                "product_info": product_info,
-                "relevant_results": {
-                    "text": text_count,
-                    "tables": table_count,
-                    "images": image_count,
-                    "total": text_count + table_count + image_count
-                },
-                "top_pages": results["by_page"][:3]  # Top 3 pages from this product
+        results: Dict[str, List[Dict[str, Any]]] = {"text": [], "tables": [], "images": []}
+        owners_by_modality = {m: np.zeros(0, dtype="int64") for m in results}
+        scores_by_modality = {m: np.zeros(0, dtype="float32") for m in results}
+        page_keys, page_scores = [], []
+        for modality in plan:
+            query_vec = query_vecs[modality]
+            scores, idxs, owners = index.search(modality, query_vec, top_k, product_ids, query=query)
+            # Modalities with a BM25 index come back RRF-fused
+            scores = UnifiedSearcher._normalize_scores(scores, by_max=index.modalities[modality].bm25 is not None)
+            results[modality] = []
+            for s, i, owner in zip(scores, idxs, owners):
+                item = index.item(modality, i)
+                product = index.products[int(owner)]
+                hit = {"score": float(s), "page": int(item.get("page", -1))}
+                for field in fields[modality]:
+                    hit[field] = item.get(field, "" if field in ("text", "markdown") else None)
+                hit["product_name"] = product["product_info"]["product_name"]
+                hit["product_category"] = product["product_info"]["product_category"]
+                hit["pdf_path"] = product["pdf_path"]
+                results[modality].append(hit)
+            owners_by_modality[modality], scores_by_modality[modality] = owners, scores
+            # Pages of different manuals are told apart by folding the product id into the key
+            pages = np.asarray(index.modalities[modality].items.pages[idxs], dtype="int64")
+            page_keys.append(np.where(pages >= 1, owners * PAGE_KEY_STRIDE + pages, -1))
+            page_scores.append(np.asarray(scores, dtype="float64") * MODALITY_WEIGHTS[modality])
+        
+        # Every page is ranked (by_product needs each product's best three); records are built only for those shown
+        keys, sums = fuse_page_scores(page_keys, page_scores, sum(len(k) for k in page_keys))
+        key_owners = keys // PAGE_KEY_STRIDE
+        
+        def page_record(j: int) -> Dict[str, Any]:
+            product = index.products[int(key_owners[j])]
+            return {
+                "page": int(keys[j] % PAGE_KEY_STRIDE),
+                "score": float(sums[j]),
+                "product_name": product["product_info"]["product_name"],
+                "product_category": product["product_info"]["product_category"],
+                "pdf_path": product["pdf_path"]
+            }
+        
+        searched = product_ids if product_ids is not None else range(len(index.products))
+        relevant = {m: np.bincount(owners_by_modality[m][scores_by_modality[m] > 0.1], minlength=len(index.products))
+                    for m in results}
+        by_product = {}
+        for owner in searched:
+            product = index.products[owner]
+            counts = {m: int(relevant[m][owner]) for m in results}
+            counts["total"] = sum(counts.values())
+            by_product[product["product_info"]["product_name"]] = {
+                "product_info": product["product_info"],
+                "relevant_results": counts,
+                "top_pages": [page_record(j) for j in np.flatnonzero(key_owners == owner)[:3]]
             }
         
-        return product_groups
+        return {
+            "by_modality": results,
+            "by_page": [page_record(j) for j in range(min(top_k, len(keys)))],
+            "by_product": by_product,
+            "total_manuals_searched": len(searched),
+            "timed_out_manuals": [],
+            "weights": dict(MODALITY_WEIGHTS)
+        }
     
-    def search_by_product_category(self, query: str, category: str, top_k: int = 5) -> Dict[str, Any]:
+    def search_by_product_category(self, query: str, category: str, top_k: int = 5,
+                                   timeout: Optional[float] = None, modalities: Optional[List[str]] = None) -> Dict[str, Any]:
         """Search only in manuals of a specific product category"""
         
+        self._refresh_unified_index()
+        if self.unified_index is not None:
+            product_ids = self.unified_index.product_ids_for(category=category)
+            if not product_ids:
+                return {"error": f"No manuals found for category: {category}"}
+            return self._search_unified(query, top_k, product_ids, modalities)
+        
         category_manuals = {
             name: data for name, data in self.manual_searchers.items()
             if data["product_info"]["product_category"] == category
@@ -178,34 +365,11 @@ class MultiManualSearcher:
             return {"error": f"No manuals found for category: {category}"}
         
         # Search only in category manuals
-        all_results = []
-        for product_name, searcher_data in category_manuals.items():
-            try:
-                searcher = searcher_data["searcher"]
-                product_info = searcher_data["product_info"]
-                
-                results = searcher.search(query, top_k=top_k)
-                
-                # Add product context
-                for modality in ["text", "tables", "images"]:
-                    for item in results["by_modality"][modality]:
-                        item["product_name"] = product_name
-                        item["product_category"] = product_info["product_category"]
-                
-                for page_result in results["by_page"]:
-                    page_result["product_name"] = product_name
-                    page_result["product_category"] = product_info["product_category"]
-                
-                all_results.append({
-                    "product_name": product_name,
-                    "product_info": product_info,
-                    "results": results
-                })
-                
-            except Exception as e:
-                logging.error(f"Search failed for {product_name}: {e}")
+        all_results, timed_out = self._search_manuals(query, category_manuals, top_k, timeout, modalities)
         
-        return self._merge_results(all_results, top_k)
+        merged = self._merge_results(all_results, top_k)
+        merged["timed_out_manuals"] = timed_out
+        return merged
     
     def get_available_products(self) -> List[Dict[str, str]]:
         """Get list of all available products"""
@@ -226,99 +390,6 @@ class MultiManualSearcher:
         return sorted(list(categories))
 
 
-class UnifiedSearcher:
-    """Wrapper class to maintain compatibility with existing search_unified.py"""
-    def __init__(self, pdf_path: str, w_text: float = 1.0, w_tables: float = 1.0, w_images: float = 1.5):
-        base = Path(pdf_path).with_suffix("")
-        self.text_idx = ModalityIndex(f"{base}_faiss").__dict__
-        self.image_idx = ModalityIndex(f"{base}_faiss_images").__dict__
-        self.table_idx = ModalityIndex(f"{base}_faiss_tables").__dict__
-        self.text_model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-        self.clip_model = SentenceTransformer("clip-ViT-B-32")
-        self.w_text = float(w_text)
-        self.w_tables = float(w_tables)
-        self.w_images = float(w_images)
-
-    @staticmethod
-    def _cosine_search(index: faiss.Index, query_vec: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
-        faiss.normalize_L2(query_vec)
-        scores, idxs = index.search(query_vec, top_k)
-        return scores[0], idxs[0]
-
-    @staticmethod
-    def _normalize_scores(scores: np.ndarray) -> np.ndarray:
-        if scores.size == 0:
-            return scores
-        s = scores - scores.min()
-        if s.max() > 0:
-            s = s / s.max()
-        return s
-
-    def search(self, query: str, top_k: int = 5) -> Dict[str, Any]:
-        if not FAISS_AVAILABLE:
-            return self._simple_search(query, top_k)
-        
-        q_text_vec = self.text_model.encode([query], convert_to_numpy=True).astype("float32")
-        q_clip_vec = self.clip_model.encode([query], convert_to_numpy=True).astype("float32")
-
-        text_scores, text_idxs = self._cosine_search(self.text_idx["index"], q_text_vec, top_k)
-        table_scores, table_idxs = self._cosine_search(self.table_idx["index"], q_text_vec, top_k)
-        image_scores, image_idxs = self._cosine_search(self.image_idx["index"], q_clip_vec, top_k)
-
-        text_scores = self._normalize_scores(text_scores)
-        table_scores = self._normalize_scores(table_scores)
-        image_scores = self._normalize_scores(image_scores)
-
-        page_scores: Dict[int, float] = {}
-        results: Dict[str, List[Dict[str, Any]]] = {"text": [], "tables": [], "images": []}
-
-        for s, i in zip(text_scores, text_idxs):
-            item = self.text_idx["items"][int(i)]
-            page = int(item.get("page", -1))
-            results["text"].append({"score": float(s), "page": page, "text": item.get("text", "")})
-            if page >= 1:
-                page_scores[page] = page_scores.get(page, 0.0) + float(s) * self.w_text
-
-        for s, i in zip(table_scores, table_idxs):
-            item = self.table_idx["items"][int(i)]
-            page = int(item.get("page", -1))
-            results["tables"].append({"score": float(s), "page": page, "markdown": item.get("markdown", ""), "csv_path": item.get("csv_path")})
-            if page >= 1:
-                page_scores[page] = page_scores.get(page, 0.0) + float(s) * self.w_tables
-
-        for s, i in zip(image_scores, image_idxs):
-            item = self.image_idx["items"][int(i)]
-            page = int(item.get("page", -1))
-            results["images"].append({"score": float(s), "page": page, "path": item.get("path")})
-            if page >= 1:
-                page_scores[page] = page_scores.get(page, 0.0) + float(s) * self.w_images
-
-        fused_pages = sorted([{"page": p, "score": sc} for p, sc in page_scores.items()], key=lambda x: x["score"], reverse=True)[:top_k]
-
-        return {"by_modality": results, "by_page": fused_pages, "weights": {"text": self.w_text, "tables": self.w_tables, "images": self.w_images}}
-    
-    def _simple_search(self, query: str, top_k: int = 5) -> Dict[str, Any]:
-        """Simple text-based search fallback when FAISS is not available"""
-        query_lower = query.lower()
-        results = {"text": [], "tables": [], "images": []}
-        
-        # Simple text search
-        for i, item in enumerate(self.text_idx["items"]):
-            text = item.get("text", "").lower()
-            if query_lower in text:
-                score = text.count(query_lower) / len(text.split())  # Simple scoring
-                results["text"].append({
-                    "score": score,
-                    "page": item.get("page", -1),
-                    "text": item.get("text", "")
-                })
-        
-        # Sort by score and limit
-        results["text"] = sorted(results["text"], key=lambda x: x["score"], reverse=True)[:top_k]
-        
-        return {"by_modality": results, "by_page": [], "weights": {"text": 1.0, "tables": 1.0, "images": 1.0}}
-
-
 def main():
     """Main function for testing the multi-manual search"""
     import argparse
@@ -326,11 +397,16 @@ def main():
     parser.add_argument("query", type=str, help="Search query")
     parser.add_argument("--top_k", type=int, default=10, help="Number of results to return")
     parser.add_argument("--category", type=str, help="Filter by product category")
+    parser.add_argument("--products", nargs="+", default=None, help="Filter by product names")
     parser.add_argument("--list-products", action="store_true", help="List available products")
     parser.add_argument("--list-categories", action="store_true", help="List available categories")
+    parser.add_argument("--workers", type=int, default=0, help="Threads for concurrent per-manual search (0: sequential)")
+    parser.add_argument("--timeout", type=float, default=None, help="Per-search deadline in seconds when --workers > 0")
+    parser.add_argument("--modalities", nargs="+", choices=["text", "tables", "images"], default=None,
+                        help="Indexes to search (default: all available)")
     args = parser.parse_args()
     
-    searcher = MultiManualSearcher()
+    searcher = MultiManualSearcher(search_workers=args.workers, search_timeout=args.timeout)
     
     if args.list_products:
         products = searcher.get_available_products()
@@ -347,9 +423,9 @@ def main():
         return
     
     if args.category:
-        results = searcher.search_by_product_category(args.query, args.category, args.top_k)
+        results = searcher.search_by_product_category(args.query, args.category, args.top_k, modalities=args.modalities)
     else:
-        results = searcher.search_all_manuals(args.query, args.top_k)
+        results = searcher.search_all_manuals(args.query, args.top_k, modalities=args.modalities, product_names=args.products)
     
     print(json.dumps(results, ensure_ascii=False, indent=2))
 
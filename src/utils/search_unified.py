@@ -1,7 +1,8 @@
 import os
 import json
+import time
 from pathlib import Path
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Tuple, Optional, Sequence
 
 import numpy as np
 from PIL import Image
@@ -15,108 +16,335 @@ except ImportError:
     FAISS_AVAILABLE = False
     print("⚠️ FAISS not available, using simple search fallback")
 
+from bm25_index import load_bm25, reciprocal_rank_fusion
+from embedding_cache import cached_encode
+from meta_store import load_meta, has_meta
+from model_registry import get_model, TEXT_MODEL, CLIP_MODEL
+from query_cache import QueryCache, file_generation
+from text_normalize import normalize, tokenize
+
+HYBRID_CANDIDATES_FACTOR = 4
+MODALITIES = ("text", "tables", "images")
+TEXT_MODALITIES = ("text", "tables")
+# Queries containing any of these words (compared as tokenize() tokens) also search images; see
+# query_wants_images. Whole tokens, so "gösterge" (the display) does not count as "göster", and plain
+# location questions ("menü nerede") stay text-only.
+IMAGE_QUERY_HINTS = ("görsel", "görseli", "görselde", "resim", "fotoğraf", "fotoğrafı", "fotoğrafta", "foto", "şekil",
+                     "şema", "şemayı", "şemada", "diyagram", "diyagramı", "çizim", "çizimi", "göster", "gösterin",
+                     "image", "picture", "photo", "figure", "diagram", "drawing", "show", "shown", "showing", "look")
+_IMAGE_HINT_TOKENS = frozenset(token for hint in IMAGE_QUERY_HINTS for token in tokenize(hint))
+# Files whose replacement means an index was rebuilt
+INDEX_FILES = ("index.faiss", "meta.offsets.npy", "bm25.npz")
+INDEX_LOAD_ATTEMPTS = 5
+INDEX_LOAD_RETRY_DELAY = 0.5  # saniye; yalnızca henüz yüklü indeks yokken beklenir
+
+# Query vectors only depend on the (fixed) models, so one cache serves every searcher
+_query_vector_cache = QueryCache()
+
+
+def query_cache_key(query: str) -> str:
+    """Normalised, whitespace-collapsed query: repeated questions differing only in case/spacing share entries."""
+    return " ".join(normalize(query).split())
+
+
+def encode_query(model: SentenceTransformer, model_name: str, query: str) -> np.ndarray:
+    """Encode a single query string, reading (never writing) the on-disk embedding cache."""
+    def encode(batch: List[str]) -> np.ndarray:
+        return model.encode(batch, convert_to_numpy=True)
+
+    return cached_encode(model_name, [query], [query.encode("utf-8")], encode, store=False)
+
+
+def read_index_mmap(index_path: str) -> "faiss.Index":
+    """Open an index memory-mapped and read-only, so worker processes share the page cache.
+
+    IO_FLAG_MMAP_IFC maps flat codes in place (newer faiss); IO_FLAG_MMAP maps IVF lists.
+    Falls back to a regular read when neither applies to this index or faiss build.
+    """
+    for flag_name in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP"):
+        flag = getattr(faiss, flag_name, None)
+        if flag is None:
+            continue
+        try:
+            return faiss.read_index(index_path, flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            continue
+    return faiss.read_index(index_path)
+
+
+def encode_normalized_query(model: SentenceTransformer, model_name: str, query: str) -> np.ndarray:
+    """L2-normalised query vector for one model, shared through the in-memory cache: do not modify it."""
+    key = (model_name, query_cache_key(query))
+    cached = _query_vector_cache.get(key)
+    if cached is not None:
+        return cached
+    vec = encode_query(model, model_name, query)
+    # NumPy rather than faiss.normalize_L2: the answer cache and the BM25-only fallback run without faiss
+    vec /= np.maximum(np.linalg.norm(vec, axis=1, keepdims=True), 1e-12)
+    _query_vector_cache.put(key, vec)
+    return vec
+
+
+def encode_query_vectors(text_model: SentenceTransformer, clip_model: SentenceTransformer, query: str) -> Tuple[np.ndarray, np.ndarray]:
+    """L2-normalised (MiniLM, CLIP) query vectors, reusable by every searcher sharing the models."""
+    return encode_normalized_query(text_model, TEXT_MODEL, query), encode_normalized_query(clip_model, CLIP_MODEL, query)
+
+
+def query_vector_cache_stats() -> Dict[str, Any]:
+    return _query_vector_cache.stats()
+
+
+def query_wants_images(query: str) -> bool:
+    """Cheap check whether a question is about something visual (where is X, show me the diagram)."""
+    return not _IMAGE_HINT_TOKENS.isdisjoint(tokenize(query))
+
+
+def plan_modalities(available: Sequence[str], modalities: Optional[Sequence[str]] = None) -> Tuple[str, ...]:
+    """Modalities to search: those requested (all by default) that have an index."""
+    return tuple(m for m in MODALITIES if m in available and (modalities is None or m in modalities))
+
+
+def fuse_page_scores(keys: List[np.ndarray], scores: List[np.ndarray], top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Sum already-weighted scores per page key (-1 = no page) and return the top_k keys and sums.
+
+    Ties keep the order in which the keys first appear, like the dict accumulation this replaces.
+    """
+    keys_all = np.concatenate(keys) if keys else np.zeros(0, dtype="int64")
+    scores_all = np.concatenate(scores) if scores else np.zeros(0, dtype="float64")
+    valid = keys_all >= 0
+    keys_all, scores_all = keys_all[valid], scores_all[valid]
+    if keys_all.size == 0:
+        return keys_all, scores_all
+    uniq, first, inverse = np.unique(keys_all, return_index=True, return_inverse=True)
+    sums = np.bincount(inverse, weights=scores_all, minlength=len(uniq))
+    candidates = np.arange(len(uniq))
+    if len(uniq) > top_k:
+        # Everything tied with the k-th best stays in, so the tie-break below decides the cut
+        kth = sums[np.argpartition(-sums, top_k - 1)[top_k - 1]]
+        candidates = np.flatnonzero(sums >= kth)
+    order = candidates[np.lexsort((first[candidates], -sums[candidates]))][:top_k]
+    return uniq[order], sums[order]
+
 
 class ModalityIndex:
     def __init__(self, index_dir: str):
         self.index_dir = index_dir
         if FAISS_AVAILABLE:
-            self.index = faiss.read_index(os.path.join(index_dir, "index.faiss"))
+            self.index = read_index_mmap(os.path.join(index_dir, "index.faiss"))
         else:
             self.index = None
             print(f"⚠️ FAISS index not available for {index_dir}")
-        
-        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
-            meta = json.load(f)
-        if "items" in meta:
-            self.items = meta["items"]
-        elif "texts" in meta:
-            self.items = [{"text": t} for t in meta["texts"]]
-        elif "images" in meta:
-            self.items = [{"path": p} for p in meta["images"]]
-        elif "tables_markdown" in meta:
-            self.items = [{"markdown": m} for m in meta["tables_markdown"]]
-        else:
-            raise ValueError("Unsupported meta.json schema")
+
+        # Items are decoded lazily from the mmapped meta.jsonl (legacy meta.json is parsed once)
+        self.items = load_meta(index_dir)
+        # Lexical index for text and tables; None for images and for pre-BM25 ingestions
+        self.bm25 = load_bm25(index_dir)
+
+    def consistent(self) -> bool:
+        """Whether index.faiss, meta.* and bm25.* come from the same write; ingestion replaces them one by one."""
+        n = len(self.items)
+        return (self.items.complete and (self.index is None or self.index.ntotal == n)
+                and (self.bm25 is None or self.bm25.num_docs == n))
 
 
 class UnifiedSearcher:
-    def __init__(self, base_path: str, w_text: float = 1.0, w_tables: float = 1.0, w_images: float = 1.5):
+    def __init__(self, base_path: str, w_text: float = 1.0, w_tables: float = 1.0, w_images: float = 1.5,
+                 text_model: Optional[SentenceTransformer] = None, clip_model: Optional[SentenceTransformer] = None):
         base = Path(base_path).with_suffix("")
-        self.text_idx = ModalityIndex(f"{base}_faiss").__dict__
-        self.image_idx = ModalityIndex(f"{base}_faiss_images").__dict__
-        self.table_idx = ModalityIndex(f"{base}_faiss_tables").__dict__
-        self.text_model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-        self.clip_model = SentenceTransformer("clip-ViT-B-32")
+        self.index_dirs = (f"{base}_faiss", f"{base}_faiss_images", f"{base}_faiss_tables")
+        self._load_indexes()
+        # Fused results keyed on (normalised query, top_k, modalities); cleared whenever an index file is replaced
+        self._result_cache = QueryCache()
+        # Models are process-wide and resolved on first use, so text-only searches never load CLIP
+        self._text_model = text_model
+        self._clip_model = clip_model
         self.w_text = float(w_text)
         self.w_tables = float(w_tables)
         self.w_images = float(w_images)
 
+    def _index_generation(self) -> tuple:
+        return file_generation(*[os.path.join(d, name) for d in self.index_dirs for name in INDEX_FILES])
+
+    def _load_indexes(self) -> None:
+        loaded = hasattr(self, "_generation")
+        for _ in range(INDEX_LOAD_ATTEMPTS):
+            generation = self._index_generation()
+            # The text index is required; ingestion skips the image/table indexes of manuals without
+            # images/tables, and those stay None
+            indexes = [ModalityIndex(self.index_dirs[0])] + [ModalityIndex(d) if has_meta(d) else None for d in self.index_dirs[1:]]
+            if all(idx.consistent() for idx in indexes if idx is not None):
+                self._generation = generation
+                self.text_idx, self.image_idx, self.table_idx = [idx.__dict__ if idx is not None else None for idx in indexes]
+                return
+            if loaded:
+                # Still being written: keep serving the previous files, the next search retries
+                return
+            time.sleep(INDEX_LOAD_RETRY_DELAY)
+        raise RuntimeError(f"Index files under {self.index_dirs[0]} do not match; is ingestion still writing them?")
+
+    @property
+    def text_model(self) -> SentenceTransformer:
+        if self._text_model is None:
+            self._text_model = get_model(TEXT_MODEL)
+        return self._text_model
+
+    @property
+    def clip_model(self) -> SentenceTransformer:
+        if self._clip_model is None:
+            self._clip_model = get_model(CLIP_MODEL)
+        return self._clip_model
+
+    @property
+    def available_modalities(self) -> Tuple[str, ...]:
+        indexes = {"text": self.text_idx, "tables": self.table_idx, "images": self.image_idx}
+        return tuple(m for m in MODALITIES if indexes[m] is not None)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return {"results": self._result_cache.stats(), "query_vectors": query_vector_cache_stats()}
+
     @staticmethod
-    def _cosine_search(index: faiss.Index, query_vec: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
-        faiss.normalize_L2(query_vec)
+    def _cosine_search(index: "faiss.Index", query_vec: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        # query_vec is already L2-normalised (encode_query_vectors) and may be shared across threads: read only
         scores, idxs = index.search(query_vec, top_k)
-        return scores[0], idxs[0]
+        # faiss pads with -1 when the index holds fewer than top_k vectors
+        keep = idxs[0] >= 0
+        return scores[0][keep], idxs[0][keep]
 
     @staticmethod
-    def _normalize_scores(scores: np.ndarray) -> np.ndarray:
+    def _normalize_scores(scores: np.ndarray, by_max: bool = False) -> np.ndarray:
+        """Scores scaled to [0, 1]: min-max for cosine similarities; by_max for BM25 and RRF scores, which
+        are positive, so a lone or last-ranked lexical hit (an exact "Err 04" match) is not zeroed."""
         if scores.size == 0:
             return scores
+        if by_max:
+            return scores / scores.max() if scores.max() > 0 else scores
         s = scores - scores.min()
         if s.max() > 0:
             s = s / s.max()
         return s
 
-    def search(self, query: str, top_k: int = 5) -> Dict[str, Any]:
+    @classmethod
+    def _hybrid_search(cls, idx: Dict[str, Any], query: str, query_vec: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Vector top-k, RRF-fused with the BM25 ranking when the index has one."""
+        if idx["bm25"] is None:
+            return cls._cosine_search(idx["index"], query_vec, top_k)
+        # A deeper candidate list from each side lets items ranked well by both rise to the top
+        candidates = top_k * HYBRID_CANDIDATES_FACTOR
+        _, vec_idxs = cls._cosine_search(idx["index"], query_vec, candidates)
+        _, lex_idxs = idx["bm25"].search(query, candidates)
+        scores, idxs = reciprocal_rank_fusion([vec_idxs, lex_idxs])
+        return scores[:top_k], idxs[:top_k]
+
+    def encode_query(self, query: str, modalities: Optional[Sequence[str]] = None) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """(MiniLM, CLIP) query vectors for the planned modalities; a vector no modality needs is None."""
+        plan = plan_modalities(MODALITIES, modalities)
+        q_text_vec = encode_normalized_query(self.text_model, TEXT_MODEL, query) if any(m in plan for m in TEXT_MODALITIES) else None
+        q_clip_vec = encode_normalized_query(self.clip_model, CLIP_MODEL, query) if "images" in plan else None
+        return q_text_vec, q_clip_vec
+
+    def search(self, query: str, top_k: int = 5, q_text_vec: Optional[np.ndarray] = None,
+               q_clip_vec: Optional[np.ndarray] = None, modalities: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """Search the requested modalities (default: all) that this manual has an index for.
+
+        Pass precomputed query vectors to skip encoding. Results are cached and shared between
+        callers: treat them as read-only.
+        """
+        generation = self._index_generation()
+        if generation != self._generation:
+            # Re-ingested since load: map the new files before serving (the cache clears on the new generation)
+            self._load_indexes()
+        plan = plan_modalities(self.available_modalities, modalities)
+        key = (query_cache_key(query), top_k, plan)
+        cached = self._result_cache.get(key, generation)
+        if cached is not None:
+            return cached
+        result = self._search(query, top_k, q_text_vec, q_clip_vec, plan)
+        self._result_cache.put(key, result, generation)
+        return result
+
+    def _search(self, query: str, top_k: int, q_text_vec: Optional[np.ndarray], q_clip_vec: Optional[np.ndarray],
+                plan: Tuple[str, ...]) -> Dict[str, Any]:
         if not FAISS_AVAILABLE:
-            return self._simple_search(query, top_k)
-        
-        q_text_vec = self.text_model.encode([query], convert_to_numpy=True).astype("float32")
-        q_clip_vec = self.clip_model.encode([query], convert_to_numpy=True).astype("float32")
+            return self._simple_search(query, top_k, plan)
 
-        text_scores, text_idxs = self._cosine_search(self.text_idx["index"], q_text_vec, top_k)
-        table_scores, table_idxs = self._cosine_search(self.table_idx["index"], q_text_vec, top_k)
-        image_scores, image_idxs = self._cosine_search(self.image_idx["index"], q_clip_vec, top_k)
+        if q_text_vec is None and any(m in plan for m in TEXT_MODALITIES):
+            q_text_vec = encode_normalized_query(self.text_model, TEXT_MODEL, query)
+        if q_clip_vec is None and "images" in plan:
+            q_clip_vec = encode_normalized_query(self.clip_model, CLIP_MODEL, query)
 
-        text_scores = self._normalize_scores(text_scores)
-        table_scores = self._normalize_scores(table_scores)
+        empty = (np.zeros(0, dtype="float32"), np.zeros(0, dtype="int64"))
+        text_scores, text_idxs = self._hybrid_search(self.text_idx, query, q_text_vec, top_k) if "text" in plan else empty
+        table_scores, table_idxs = self._hybrid_search(self.table_idx, query, q_text_vec, top_k) if "tables" in plan else empty
+        image_scores, image_idxs = self._cosine_search(self.image_idx["index"], q_clip_vec, top_k) if "images" in plan else empty
+
+        # _hybrid_search returns RRF scores wherever the index has BM25
+        text_scores = self._normalize_scores(text_scores, by_max=self.text_idx["bm25"] is not None)
+        table_scores = self._normalize_scores(table_scores, by_max=self.table_idx is not None and self.table_idx["bm25"] is not None)
         image_scores = self._normalize_scores(image_scores)
 
-        page_scores: Dict[int, float] = {}
-        results: Dict[str, List[Dict[str, Any]]] = {"text": [], "tables": [], "images": []}
+        results: Dict[str, List[Dict[str, Any]]] = {
+            "text": [{"score": float(sc), "page": int(item.get("page", -1)), "text": item.get("text", "")}
+                     for sc, item in zip(text_scores, self._items(self.text_idx, text_idxs))],
+            "tables": [{"score": float(sc), "page": int(item.get("page", -1)), "markdown": item.get("markdown", ""), "csv_path": item.get("csv_path")}
+                       for sc, item in zip(table_scores, self._items(self.table_idx, table_idxs))],
+            "images": [{"score": float(sc), "page": int(item.get("page", -1)), "path": item.get("path")}
+                       for sc, item in zip(image_scores, self._items(self.image_idx, image_idxs))],
+        }
 
-        for s, i in zip(text_scores, text_idxs):
-            item = self.text_idx["items"][int(i)]
-            page = int(item.get("page", -1))
-            results["text"].append({"score": float(s), "page": page, "text": item.get("text", "")})
-            if page >= 1:
-                page_scores[page] = page_scores.get(page, 0.0) + float(s) * self.w_text
-
-        for s, i in zip(table_scores, table_idxs):
-            item = self.table_idx["items"][int(i)]
-            page = int(item.get("page", -1))
-            results["tables"].append({"score": float(s), "page": page, "markdown": item.get("markdown", ""), "csv_path": item.get("csv_path")})
-            if page >= 1:
-                page_scores[page] = page_scores.get(page, 0.0) + float(s) * self.w_tables
-
-        for s, i in zip(image_scores, image_idxs):
-            item = self.image_idx["items"][int(i)]
-            page = int(item.get("page", -1))
-            results["images"].append({"score": float(s), "page": page, "path": item.get("path")})
-            if page >= 1:
-                page_scores[page] = page_scores.get(page, 0.0) + float(s) * self.w_images
-
-        fused_pages = sorted([{"page": p, "score": sc} for p, sc in page_scores.items()], key=lambda x: x["score"], reverse=True)[:top_k]
+        fused_pages = self._fuse_pages([(self.text_idx, text_idxs, text_scores, self.w_text),
+                                        (self.table_idx, table_idxs, table_scores, self.w_tables),
+                                        (self.image_idx, image_idxs, image_scores, self.w_images)], top_k)
+
+        return {"by_modality": results, "by_page": fused_pages, "weights": {"text": self.w_text, "tables": self.w_tables, "images": self.w_images}}
 
+    @staticmethod
+    def _items(idx: Dict[str, Any], idxs: np.ndarray) -> List[Dict[str, Any]]:
+        return [idx["items"][int(i)] for i in idxs]
+
+    @staticmethod
+    def _fuse_pages(hits: List[Tuple[Optional[Dict[str, Any]], np.ndarray, np.ndarray, float]], top_k: int) -> List[Dict[str, Any]]:
+        """Weighted per-page score sums from (index, item ids, scores, weight) hits, top_k pages first."""
+        keys, scores = [], []
+        for idx, idxs, sc, weight in hits:
+            pages = np.asarray(idx["items"].pages[idxs], dtype="int64") if len(idxs) else np.zeros(0, dtype="int64")
+            keys.append(np.where(pages >= 1, pages, -1))
+            scores.append(np.asarray(sc, dtype="float64") * weight)
+        pages, page_scores = fuse_page_scores(keys, scores, top_k)
+        return [{"page": int(p), "score": float(sc)} for p, sc in zip(pages, page_scores)]
+    
+    def _simple_search(self, query: str, top_k: int = 5, plan: Tuple[str, ...] = TEXT_MODALITIES) -> Dict[str, Any]:
+        """Lexical fallback when FAISS is not available: BM25 over text and tables"""
+        if self.text_idx["bm25"] is None:
+            return self._substring_search(query, top_k)
+        
+        hits = []
+        results: Dict[str, List[Dict[str, Any]]] = {"text": [], "tables": [], "images": []}
+        
+        for modality, idx, weight in (("text", self.text_idx, self.w_text), ("tables", self.table_idx, self.w_tables)):
+            if modality not in plan or idx is None or idx["bm25"] is None:
+                continue
+            scores, idxs = idx["bm25"].search(query, top_k)
+            scores = self._normalize_scores(scores, by_max=True)
+            for sc, item in zip(scores, self._items(idx, idxs)):
+                page = int(item.get("page", -1))
+                if modality == "text":
+                    results["text"].append({"score": float(sc), "page": page, "text": item.get("text", "")})
+                else:
+                    results["tables"].append({"score": float(sc), "page": page, "markdown": item.get("markdown", ""), "csv_path": item.get("csv_path")})
+            hits.append((idx, idxs, scores, weight))
+        
+        fused_pages = self._fuse_pages(hits, top_k)
+        
         return {"by_modality": results, "by_page": fused_pages, "weights": {"text": self.w_text, "tables": self.w_tables, "images": self.w_images}}
     
-    def _simple_search(self, query: str, top_k: int = 5) -> Dict[str, Any]:
-        """Simple text-based search fallback when FAISS is not available"""
-        query_lower = query.lower()
+    def _substring_search(self, query: str, top_k: int = 5) -> Dict[str, Any]:
+        """Substring scan for manuals ingested before BM25 indexes were written"""
+        query_lower = normalize(query)
         results = {"text": [], "tables": [], "images": []}
         
         # Simple text search
         for i, item in enumerate(self.text_idx["items"]):
-            text = item.get("text", "").lower()
+            text = normalize(item.get("text", ""))
             if query_lower in text:
                 score = text.count(query_lower) / len(text.split())  # Simple scoring
                 results["text"].append({
@@ -0,0 +1,102 @@
+"""
+Shared text normaliser and tokenizer for lexical search and keyword classification.
+
+Users write Turkish, the manuals are English: both sides are folded to the same ASCII-ish form
+(İ/I/ı -> i, ç -> c, ğ -> g, ö -> o, ş -> s, ü -> u, other diacritics stripped) so "KALİBRASYON",
+"kalibrasyon" and "Kalibrasyon" all match. str.lower() alone maps "İ" to "i̇" and leaves "ı"
+untouched. Tokens get a light, language-neutral suffix strip. Index and query time must share
+TOKENIZER_VERSION; indexes built with another version are rebuilt rather than read.
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+from typing import List, Optional
+
+TOKENIZER_VERSION = 3
+MIN_STEM_LENGTH = 3  # letters kept after suffix stripping
+
+# Dotted/dotless i are folded before lowercasing: "İ".lower() would leave a combining dot
+_FOLD_TABLE = str.maketrans({
+    "İ": "i", "I": "i", "ı": "i",
+    "Ç": "c", "ç": "c", "Ğ": "g", "ğ": "g", "Ö": "o", "ö": "o", "Ş": "s", "ş": "s", "Ü": "u", "ü": "u",
+    "Â": "a", "â": "a", "Î": "i", "î": "i", "Û": "u", "û": "u",
+})
+_WORD_RE = re.compile(r"\w+")
+_ALNUM_SPLIT_RE = re.compile(r"[^\W\d_]+|\d+")
+# Folded Turkish plural/case endings and the English plural, longest first. A bare ablative
+# (-dan/-den/-tan/-ten) is not stripped: it would cut English words ("garden", "written").
+_SUFFIXES = ("larindan", "lerinden", "lardan", "lerden", "larinda", "lerinde", "larini", "lerini", "larin", "lerin",
+             "lari", "leri", "lar", "ler", "s")
+_NO_STRIP_S = ("ss", "us", "is", "ies")
+_GENITIVE_SUFFIXES = ("in", "un")  # folded -ın/-in/-un/-ün after a consonant
+_VOWELS = frozenset("aeiou")
+_VOICED_FINALS = frozenset("bcdg")  # devoiced at a Turkish word end (kitap, kitabın)
+_NON_TURKISH_LETTERS = frozenset("qwx")
+
+
+def normalize(text: str) -> str:
+    """Case- and diacritic-folded form of text, for substring matching and tokenizing."""
+    text = text.translate(_FOLD_TABLE).lower()
+    if text.isascii():
+        return text
+    # Remaining accents (é, à, ...) are decomposed and their combining marks dropped
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def _strip_suffix(token: str) -> str:
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM_LENGTH:
+            if suffix == "s" and token.endswith(_NO_STRIP_S):
+                continue
+            return token[:-len(suffix)]
+    return token
+
+
+def _turkish_genitive(base: str, suffix: str) -> bool:
+    """Whether base + suffix can be a Turkish genitive: the suffix vowel follows the last vowel of
+    base (ekran-in, kalibrasyon-un) and base is spelled like a Turkish stem. English words such as
+    "login", "plugin", "origin" or "within" fail one of the checks."""
+    vowels = [c for c in base if c in _VOWELS]
+    if not vowels or (vowels[-1] in "ou") != suffix.endswith("un"):
+        return False
+    return base[-1] not in _VOICED_FINALS and not _NON_TURKISH_LETTERS.intersection(base)
+
+
+def _strip_genitive(token: str) -> str:
+    """Consonant-stem genitive: "ekranin" -> "ekran", "kalibrasyonun" -> "kalibrasyon"."""
+    if (token.endswith(_GENITIVE_SUFFIXES) and len(token) - 2 >= MIN_STEM_LENGTH
+            and token[-3] not in _VOWELS and _turkish_genitive(token[:-2], token[-2:])):
+        return token[:-2]
+    return token
+
+
+@lru_cache(maxsize=65536)
+def stem(token: str) -> str:
+    """Strip known suffixes ("ekranlardan" -> "ekran", "cihazin" -> "cihaz") from an alphabetic token."""
+    if not token.isalpha():
+        return token
+    return _strip_suffix(_strip_genitive(_strip_suffix(token)))
+
+
+def _vowel_stem(token: str) -> Optional[str]:
+    """The -nin/-nun reading of a word stem() read as -in/-un: "terazinin" -> "terazi", else None."""
+    if (token.isalpha() and token.endswith(("nin", "nun")) and len(token) - 3 >= MIN_STEM_LENGTH
+            and token[-4] in _VOWELS and _turkish_genitive(token[:-3], token[-3:])):
+        return _strip_suffix(token[:-3])
+    return None
+
+
+def tokenize(text: str) -> List[str]:
+    """Normalised, stemmed word tokens; mixed codes like "err04" also yield their letter and digit runs."""
+    tokens: List[str] = []
+    for word in _WORD_RE.findall(normalize(text)):
+        tokens.append(stem(word))
+        # "ekranin" (ekran + in) and "terazinin" (terazi + nin) look alike: both readings are kept
+        alternative = _vowel_stem(word)
+        if alternative:
+            tokens.append(alternative)
+        parts = _ALNUM_SPLIT_RE.findall(word)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
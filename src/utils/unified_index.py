@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Cross-manual FAISS indexes: every processed manual merged into one index per modality.
+
+Manuals are laid out sorted by (category, product), so each product and each category owns a
+contiguous id range. Alongside each merged index, product_ids.npy holds the product id of every
+vector. A search restricted to some products (or to a category's products) is then a single
+filtered top-k (faiss IDSelectorRange / IDSelectorBatch) instead of one search per manual plus a
+Python merge.
+"""
+
+import os
+import json
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Without faiss there is no merged index: load_unified_index returns None and searches stay per manual
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+from meta_store import load_meta
+from bm25_index import reciprocal_rank_fusion
+from search_unified import ModalityIndex, HYBRID_CANDIDATES_FACTOR
+
+UNIFIED_INDEX_DIRNAME = "unified_index"
+MANIFEST_FILE = "unified_manifest.json"
+PRODUCT_IDS_FILE = "product_ids.npy"
+MODALITY_DIRS = {"text": "_faiss", "images": "_faiss_images", "tables": "_faiss_tables"}
+BM25_FIELDS = {"text": "text", "tables": "markdown"}
+
+
+def _source_dir(pdf_path: str, modality: str) -> str:
+    return f"{Path(pdf_path).with_suffix('')}{MODALITY_DIRS[modality]}"
+
+
+def _source_mtime(pdf_path: str, modality: str) -> Optional[float]:
+    path = os.path.join(_source_dir(pdf_path, modality), "index.faiss")
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+
+def _reconstruct_all(index: "faiss.Index") -> np.ndarray:
+    """All stored vectors of a per-manual index (approximate for IVF-PQ codes)."""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype="float32")
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def _ranges(ids: np.ndarray, num_ids: int) -> List[List[int]]:
+    """[start, end) of every id in a column sorted by id; empty ids get [n, n)."""
+    bounds = np.searchsorted(ids, np.arange(num_ids + 1))
+    return [[int(bounds[i]), int(bounds[i + 1])] for i in range(num_ids)]
+
+
+def build_unified_index(metadata_file: str, out_dir: Optional[str] = None, index_type: str = "flat") -> Dict[str, Any]:
+    """Merge the per-manual indexes listed in metadata_file into one index per modality."""
+    if not FAISS_AVAILABLE:
+        raise RuntimeError("faiss is required to build the unified index")
+    from process_pdf import build_faiss_index, persist_faiss
+    from bm25_index import write_bm25
+
+    with open(metadata_file, "r", encoding="utf-8") as f:
+        manuals = json.load(f).get("manuals", [])
+    out_dir = out_dir or os.path.join(os.path.dirname(os.path.abspath(metadata_file)), UNIFIED_INDEX_DIRNAME)
+
+    # Manuals need a text index; image and table indexes only exist for manuals that have images/tables
+    products = []
+    for manual in manuals:
+        if _source_mtime(manual["pdf_path"], "text") is None:
+            print(f"⚠️ Skipping {manual['product_info']['product_name']}: no text index")
+            continue
+        products.append(manual)
+    products.sort(key=lambda m: (m["product_info"]["product_category"], m["product_info"]["product_name"]))
+    categories = sorted({m["product_info"]["product_category"] for m in products})
+
+    ranges: Dict[str, Dict[str, List[List[int]]]] = {}
+    for modality in MODALITY_DIRS:
+        vectors, items, product_ids = [], [], []
+        for product_id, manual in enumerate(products):
+            src = _source_dir(manual["pdf_path"], modality)
+            if _source_mtime(manual["pdf_path"], modality) is None:
+                continue
+            index = faiss.read_index(os.path.join(src, "index.faiss"))
+            vectors.append(_reconstruct_all(index))
+            items.extend(load_meta(src))
+            product_ids.extend([product_id] * index.ntotal)
+        modality_dir = os.path.join(out_dir, modality)
+        if not vectors:
+            # No manual has this modality: searches skip it
+            shutil.rmtree(modality_dir, ignore_errors=True)
+            continue
+        embeddings = np.concatenate(vectors).astype("float32")
+        product_col = np.asarray(product_ids, dtype="int32")
+
+        persist_faiss(build_faiss_index(embeddings, index_type=index_type), items, modality_dir)
+        path = os.path.join(modality_dir, PRODUCT_IDS_FILE)
+        with open(f"{path}.tmp", "wb") as f:
+            np.save(f, product_col)
+        os.replace(f"{path}.tmp", path)
+        if modality in BM25_FIELDS:
+            write_bm25([it.get(BM25_FIELDS[modality], "") for it in items], modality_dir)
+        ranges[modality] = {"product": _ranges(product_col, len(products))}
+
+    manifest = {
+        "index_type": index_type,
+        "products": [{"product_info": m["product_info"], "pdf_path": m["pdf_path"]} for m in products],
+        "categories": categories,
+        "modalities": list(ranges),
+        "ranges": ranges,
+        "sources": {m["pdf_path"]: {mod: _source_mtime(m["pdf_path"], mod) for mod in MODALITY_DIRS} for m in products},
+    }
+    tmp = os.path.join(out_dir, f"{MANIFEST_FILE}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, os.path.join(out_dir, MANIFEST_FILE))
+    return manifest
+
+
+class UnifiedManualIndex:
+    """Read side of build_unified_index: filtered top-k over all manuals at once."""
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.products: List[Dict[str, Any]] = self.manifest["products"]
+        self.categories: List[str] = self.manifest["categories"]
+        names = self.manifest.get("modalities", list(MODALITY_DIRS))
+        self.modalities = {m: ModalityIndex(os.path.join(index_dir, m)) for m in names}
+        self.product_ids = {m: np.load(os.path.join(index_dir, m, PRODUCT_IDS_FILE), mmap_mode="r") for m in names}
+
+    def is_stale(self) -> bool:
+        """True once any source manual has been re-indexed (or removed) since the merge."""
+        for pdf_path, mtimes in self.manifest["sources"].items():
+            if any(_source_mtime(pdf_path, m) != mtime for m, mtime in mtimes.items()):
+                return True
+        return False
+
+    def product_ids_for(self, product_names: Optional[Sequence[str]] = None, category: Optional[str] = None) -> List[int]:
+        return [i for i, p in enumerate(self.products)
+                if (product_names is None or p["product_info"]["product_name"] in product_names)
+                and (category is None or p["product_info"]["product_category"] == category)]
+
+    def _selector(self, modality: str, product_ids: List[int]) -> "faiss.IDSelector":
+        spans = sorted(tuple(self.manifest["ranges"][modality]["product"][p]) for p in product_ids)
+        spans = [s for s in spans if s[1] > s[0]]
+        if not spans:
+            return faiss.IDSelectorRange(0, 0)
+        # Products of one category are adjacent, so category filters collapse to a single range
+        merged = [list(spans[0])]
+        for lo, hi in spans[1:]:
+            if lo == merged[-1][1]:
+                merged[-1][1] = hi
+            else:
+                merged.append([lo, hi])
+        if len(merged) == 1:
+            return faiss.IDSelectorRange(merged[0][0], merged[0][1])
+        ids = np.concatenate([np.arange(lo, hi, dtype="int64") for lo, hi in merged])
+        return faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+
+    @staticmethod
+    def _search_params(index: "faiss.Index", sel: "faiss.IDSelector") -> "faiss.SearchParameters":
+        if isinstance(index, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(sel=sel, nprobe=index.nprobe)
+        if isinstance(index, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=sel, efSearch=index.hnsw.efSearch)
+        return faiss.SearchParameters(sel=sel)
+
+    def _vector_search(self, modality: str, query_vec: np.ndarray, top_k: int,
+                       product_ids: Optional[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+        index = self.modalities[modality].index
+        if product_ids is None:
+            scores, idxs = index.search(query_vec, top_k)
+        else:
+            sel = self._selector(modality, product_ids)
+            scores, idxs = index.search(query_vec, top_k, params=self._search_params(index, sel))
+        keep = idxs[0] >= 0
+        return scores[0][keep], idxs[0][keep]
+
+    def search(self, modality: str, query_vec: np.ndarray, top_k: int, product_ids: Optional[List[int]] = None,
+               query: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(scores, item ids, product ids) of the filtered top-k; padding (-1) ids are dropped.
+
+        With the query text, modalities that have a BM25 index are RRF-fused with the lexical ranking.
+        """
+        bm25 = self.modalities[modality].bm25
+        if query is None or bm25 is None:
+            scores, idxs = self._vector_search(modality, query_vec, top_k, product_ids)
+        else:
+            candidates = top_k * HYBRID_CANDIDATES_FACTOR
+            _, vec_idxs = self._vector_search(modality, query_vec, candidates, product_ids)
+            allowed = None
+            if product_ids is not None:
+                allowed = np.isin(self.product_ids[modality], np.asarray(product_ids, dtype="int32"))
+            _, lex_idxs = bm25.search(query, candidates, allowed)
+            scores, idxs = reciprocal_rank_fusion([vec_idxs, lex_idxs])
+            scores, idxs = scores[:top_k], idxs[:top_k]
+        return scores, idxs, np.asarray(self.product_ids[modality][idxs], dtype="int64")
+
+    def item(self, modality: str, idx: int) -> Dict[str, Any]:
+        return self.modalities[modality].items[int(idx)]
+
+
+def load_unified_index(index_dir: str) -> Optional[UnifiedManualIndex]:
+    """The merged index if it exists and is current, else None (callers fall back to per-manual search)."""
+    if not FAISS_AVAILABLE or not os.path.exists(os.path.join(index_dir, MANIFEST_FILE)):
+        return None
+    try:
+        index = UnifiedManualIndex(index_dir)
+    except Exception as e:
+        print(f"⚠️ Unified index unavailable ({index_dir}): {e}")
+        return None
+    if index.is_stale():
+        print(f"⚠️ Unified index at {index_dir} is older than its manuals; rebuild it with unified_index.py")
+        return None
+    return index
+
+
+if __name__ == "__main__":
+    import argparse
+    from process_pdf import INDEX_TYPES
+    parser = argparse.ArgumentParser()
+    parser.add_argument("metadata_file", type=str, nargs="?", default="manuals_metadata.json")
+    parser.add_argument("--out", type=str, default=None, help=f"Output directory (default: <metadata dir>/{UNIFIED_INDEX_DIRNAME})")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    args = parser.parse_args()
+    manifest = build_unified_index(args.metadata_file, args.out, args.index_type)
+    print(json.dumps({
+        "num_products": len(manifest["products"]),
+        "categories": manifest["categories"],
+        "vectors": {m: r["product"][-1][1] if r["product"] else 0 for m, r in manifest["ranges"].items()},
+    }, ensure_ascii=False))
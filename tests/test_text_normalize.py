@@ -0,0 +1,65 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src', 'utils'))
+from text_normalize import normalize, tokenize
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("KALİBRASYON", "kalibrasyon"),
+    ("Işık göstergesi", "isik gostergesi"),
+    ("café", "cafe"),
+])
+def test_normalize(text, expected):
+    assert normalize(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    # Turkish inflections share the stem of the bare word
+    ("ekran", ["ekran"]),
+    ("ekranlar", ["ekran"]),
+    ("ekranlardan", ["ekran"]),
+    ("cihazın", ["cihaz"]),
+    ("cihazların", ["cihaz"]),
+    # English words keep their stems
+    ("written", ["written"]),
+    ("garden", ["garden"]),
+    ("errors", ["error"]),
+    ("status", ["status"]),
+    ("class", ["class"]),
+    ("within", ["within"]),
+    ("login", ["login"]),
+    ("plugin", ["plugin"]),
+    ("plugins", ["plugin"]),
+    ("origin", ["origin"]),
+    ("margin", ["margin"]),
+    ("series", ["series"]),
+    # Error codes also yield their letter and digit runs
+    ("Err04", ["err04", "err", "04"]),
+])
+def test_tokenize(text, expected):
+    assert tokenize(text) == expected
+
+
+@pytest.mark.parametrize("bare, inflected", [
+    ("ekran", "ekranın"),
+    ("kalibrasyon", "kalibrasyonun"),
+    ("cihaz", "cihazın"),
+    ("terazi", "terazinin"),
+    ("menü", "menünün"),
+    ("gösterge", "göstergenin"),
+])
+def test_inflected_form_matches_bare_word(bare, inflected):
+    assert set(tokenize(bare)) <= set(tokenize(inflected))
+
+
+@pytest.mark.parametrize("word, other", [
+    ("within", "with"),
+    ("login", "log"),
+    ("plugin", "plug"),
+    ("begin", "beg"),
+])
+def test_english_words_do_not_merge(word, other):
+    assert not set(tokenize(word)) & set(tokenize(other))